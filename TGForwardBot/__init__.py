@@ -1,77 +1,207 @@
 """TG双向私聊/群组话题机器人插件"""
 import logging
 import asyncio
+import importlib
+import sys
+from typing import Any, Optional, Set, Tuple
 
 from notifyhub.plugins.common import after_setup
 
-from .bot import start_bot, stop_bot, get_bot
-from .group import start_group_bot, stop_group_bot, get_group_bot
-from .config import config
+from .config import get_config
+
+# 导入子模块时包属性 config 会指向 config.py 模块本身，删除后由下方 __getattr__ 导出配置实例
+del config
 
 logger = logging.getLogger(__name__)
 
 PLUGIN_ID = "TGForwardBot"
 
 
+_VALID_MODES = frozenset(("private", "group"))
+
+# 已解析的转发模式缓存（首次调用时计算）
+_FORWARD_MODE: Optional[str] = None
+
+
+# 配置校验结果缓存：(转发模式, 配置是否有效)
+_VALIDATED: Optional[Tuple[str, bool]] = None
+
+# 是否已向配置注册失效回调（首次校验配置时注册）
+_HOOK_REGISTERED = False
+
+
+def _reset_forward_mode_cache():
+    """清除转发模式及配置校验缓存（配置重载后调用）"""
+    global _FORWARD_MODE, _VALIDATED
+    _FORWARD_MODE = None
+    _VALIDATED = None
+
+
 def _get_forward_mode() -> str:
     """获取转发模式（private/group），非法值回退为 private"""
-    try:
-        mode = (config.forward_mode or "private").lower().strip()
-        if mode not in {"private", "group"}:
-            logger.warning(f"[{PLUGIN_ID}] 未知转发模式 {mode}，回退为 private")
-            return "private"
+    global _FORWARD_MODE
+    mode = _FORWARD_MODE
+    if mode is not None:
         return mode
+    try:
+        raw = getattr(get_config(), "forward_mode", None) or "private"
+        mode = raw.lower().strip()
+        if mode not in _VALID_MODES:
+            logger.warning("[%s] 未知转发模式 %s，回退为 private", PLUGIN_ID, mode)
+            mode = "private"
     except Exception:
-        return "private"
+        mode = "private"
+    _FORWARD_MODE = mode
+    return mode
+
+
+def _validate_config() -> Tuple[str, bool]:
+    """校验当前模式下的配置，仅在校验成功完成后缓存结果"""
+    global _VALIDATED, _HOOK_REGISTERED
+    if _VALIDATED is not None:
+        return _VALIDATED
+    config = get_config()
+    if not _HOOK_REGISTERED:
+        config.add_invalidate_hook(_reset_forward_mode_cache)
+        _HOOK_REGISTERED = True
+    mode = _get_forward_mode()
+    try:
+        valid = config.is_group_mode_valid() if mode == "group" else config.is_valid()
+    except Exception as e:
+        logger.error("[%s] 校验配置失败: %s", PLUGIN_ID, e, exc_info=True)
+        return mode, False
+    if not valid:
+        label = "群组模式" if mode == "group" else "私聊模式"
+        logger.error("[%s] %s配置无效，未启动", PLUGIN_ID, label)
+    _VALIDATED = (mode, valid)
+    return _VALIDATED
+
+
+# 后台运行任务的强引用（asyncio 仅弱引用任务）
+_BG_TASKS: Set[asyncio.Task] = set()
+
+# 机器人开始接收更新后置位、停止后清除，其他插件可 await bot_ready.wait() 等待就绪
+bot_ready = asyncio.Event()
+
+
+def __getattr__(name: str) -> Any:
+    """兼容 `from TGForwardBot import config`：按需创建全局配置实例"""
+    if name == "config":
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _backend_module_name(mode: str) -> str:
+    """获取对应模式的模块名"""
+    return f"{__name__}.group" if mode == "group" else f"{__name__}.bot"
+
+
+async def _import_backend(mode: str):
+    """在线程池中导入对应模式的模块，避免首次导入阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, importlib.import_module, _backend_module_name(mode))
+
+
+def _loaded_backend(mode: str):
+    """返回已加载的对应模式模块，未加载时返回 None（不会触发导入）"""
+    return sys.modules.get(_backend_module_name(mode))
+
+
+def _update_bot_ready(mode: str):
+    """按对应模式机器人的实际运行状态设置或清除 bot_ready"""
+    backend = _loaded_backend(mode)
+    instance = None
+    if backend:
+        instance = backend.get_group_bot() if mode == "group" else backend.get_bot()
+    if instance is not None and instance.is_running:
+        bot_ready.set()
+    else:
+        bot_ready.clear()
+
+
+# 以下接口按需加载对应模式的模块：私聊模式下不会导入 .group，反之亦然
+def get_bot():
+    """获取私聊模式机器人实例"""
+    backend = _loaded_backend("private")
+    return backend.get_bot() if backend else None
+
+
+async def start_bot():
+    """启动私聊模式机器人"""
+    backend = await _import_backend("private")
+    await backend.start_bot()
+    _update_bot_ready("private")
+
+
+async def stop_bot():
+    """停止私聊模式机器人"""
+    backend = _loaded_backend("private")
+    if backend:
+        await backend.stop_bot()
+    bot_ready.clear()
+
+
+def get_group_bot():
+    """获取群组模式机器人实例"""
+    backend = _loaded_backend("group")
+    return backend.get_group_bot() if backend else None
+
+
+async def start_group_bot():
+    """启动群组模式机器人"""
+    backend = await _import_backend("group")
+    await backend.start_group_bot()
+    _update_bot_ready("group")
+
+
+async def stop_group_bot():
+    """停止群组模式机器人"""
+    backend = _loaded_backend("group")
+    if backend:
+        await backend.stop_group_bot()
+    bot_ready.clear()
 
 
 @after_setup(PLUGIN_ID, "初始化TG转发机器人")
 async def init_tg_bot():
     """根据配置模式启动私聊模式或群组话题模式"""
     try:
-        mode = _get_forward_mode()
+        mode, valid = _validate_config()
+        if not valid:
+            return
         
+        backend = await _import_backend(mode)
         if mode == "group":
-            if not config.is_group_mode_valid():
-                logger.error(f"[{PLUGIN_ID}] 群组模式配置无效，未启动")
-                return
-            from .group import init_group_bot  # 延迟导入以避免未使用时加载
-            init_success = await init_group_bot()
-            if not init_success:
-                logger.error(f"[{PLUGIN_ID}] 群组模式初始化失败")
-                return
-            
-            async def run_background():
-                try:
-                    logger.info(f"[{PLUGIN_ID}] 正在后台启动群组话题模式...")
-                    await start_group_bot()
-                except Exception as e:
-                    logger.error(f"[{PLUGIN_ID}] 群组模式运行出错: {e}", exc_info=True)
+            label = "群组话题模式"
+            init_backend, start_backend = backend.init_group_bot, backend.start_group_bot
         else:
-            if not config.is_valid():
-                return
-            from .bot import init_bot  # 延迟导入
-            init_success = await init_bot()
-            if not init_success:
-                logger.error(f"[{PLUGIN_ID}] 私聊模式初始化失败")
-                return
-            
-            async def run_background():
-                try:
-                    logger.info(f"[{PLUGIN_ID}] 正在后台启动私聊模式...")
-                    await start_bot()
-                except Exception as e:
-                    logger.error(f"[{PLUGIN_ID}] 私聊模式运行出错: {e}", exc_info=True)
+            label = "私聊模式"
+            init_backend, start_backend = backend.init_bot, backend.start_bot
+        
+        if not await init_backend():
+            logger.error("[%s] %s初始化失败", PLUGIN_ID, label)
+            return
+        
+        async def run_background():
+            try:
+                logger.info("[%s] 正在后台启动%s...", PLUGIN_ID, label)
+                await start_backend()
+                # start 可能因初始化失败或已在运行而提前返回，按实际状态置位
+                _update_bot_ready(mode)
+                if not bot_ready.is_set():
+                    logger.error("[%s] %s未能启动", PLUGIN_ID, label)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("[%s] %s运行出错: %s", PLUGIN_ID, label, e)
         
-        # 创建后台任务启动对应模式
-        try:
-            loop = asyncio.get_running_loop()
-            loop.create_task(run_background())
-        except RuntimeError:
-            asyncio.create_task(run_background())
+        # 创建后台任务启动对应模式（保留引用，避免任务被回收）
+        task = asyncio.create_task(run_background())
+        _BG_TASKS.add(task)
+        task.add_done_callback(_BG_TASKS.discard)
         
     except Exception as e:
-        logger.error(f"[{PLUGIN_ID}] 初始化Telegram机器人失败: {e}", exc_info=True)
+        logger.error("[%s] 初始化Telegram机器人失败: %s", PLUGIN_ID, e, exc_info=True)
 
 
 # 导出主要接口
@@ -79,6 +209,7 @@ __all__ = [
     "get_bot",
     "get_group_bot",
     "config",
+    "bot_ready",
     "start_bot",
     "stop_bot",
     "start_group_bot",
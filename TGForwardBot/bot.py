@@ -1,11 +1,20 @@
 """
 Telegram 双向私聊机器人核心逻辑
 """
-import re
 import logging
 import asyncio
-from typing import Optional, Dict, Any
-from telegram import Update, Bot, InlineKeyboardButton, InlineKeyboardMarkup, Message
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
+from telegram import (
+    Update,
+    Bot,
+    InlineKeyboardMarkup,
+    Message,
+    InputMediaPhoto,
+    InputMediaVideo,
+    InputMediaDocument,
+    InputMediaAudio,
+)
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -15,13 +24,24 @@ from telegram.ext import (
     filters
 )
 from telegram.error import TelegramError, BadRequest
-from telegram.request import HTTPXRequest
 
 from .config import config
 from .utils import (
+    build_application,
+    start_updater,
+    detect_media,
+    MEDIA_SEND_METHODS,
+    format_user_info,
+    forward_markup,
+    forward_user_name,
+    remember_forward,
+    lookup_forward,
+    get_manager_id,
     is_manager,
+    log_error,
     contains_block_keywords,
     delete_message_after_delay,
+    flush_pending_deletes,
     extract_user_id_from_message,
     extract_user_name_from_message,
     handle_help_command,
@@ -29,12 +49,39 @@ from .utils import (
     handle_block_list_command,
     show_block_list,
     handle_callback_query_common,
+    HELP_REPLY_MARKUP,
+    WELCOME_TPL,
 )
 
 logger = logging.getLogger(__name__)
 
 PLUGIN_ID = "TGForwardBot"
 
+# 纯文本管理员通知的合并参数
+_NOTIFY_BATCH_WINDOW = 0.3  # 等待后续通知的时间窗口（秒）
+_NOTIFY_BATCH_MAX = 20  # 单次合并的最大通知数
+_NOTIFY_MAX_LEN = 4000  # 合并后单条消息的最大长度（Telegram 上限 4096）
+_NOTIFY_JOINER = "\n---\n"
+_NOTIFY_QUEUE_MAX = 500  # 待发送通知上限，超出时丢弃最早的通知
+
+_ACK_REACTION = "👌"  # 确认收到用户消息时添加的表情回应
+_CHAT_WORKER_IDLE = 60  # 会话工作协程空闲多久后退出（秒）
+_CHAT_QUEUE_MAX = 100  # 单个会话最多积压的转发任务数，超出后丢弃新任务
+_DROP_NOTICE = "消息发送过于频繁，未能转发给管理员，请稍后重试。"  # 丢弃新任务时回复用户的提示
+_MANAGER_DROP_NOTICE = "回复过于频繁，该消息未发送给用户，请稍后重试。"  # 丢弃管理员回复时的提示
+_PRIVACY_CACHE_MAX = 10000  # 记录的隐私受限用户数上限
+
+# 相册（media group）合并转发参数
+_ALBUM_WINDOW = 0.3  # 收集同一相册后续消息的时间窗口（秒）
+_ALBUM_MAX = 10  # send_media_group 单次最多发送的媒体数
+# 可放入相册的媒体类型键 -> InputMedia 类型（语音不支持相册）
+_ALBUM_MEDIA = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio,
+}
+
 
 class TGBot:
     """Telegram 双向私聊机器人"""
@@ -42,30 +89,40 @@ class TGBot:
     def __init__(self):
         self.application: Optional[Application] = None
         self.bot: Optional[Bot] = None
-        self._running = False
+        # 启停互斥锁与运行状态（可 await self._started.wait() 等待启动完成）
+        self._state_lock = asyncio.Lock()
+        self._started = asyncio.Event()
+        self._notify_queue: Optional[asyncio.Queue] = None
+        self._notify_task: Optional[asyncio.Task] = None
+        # 会话ID -> 待执行任务队列 / 工作协程
+        self._chat_queues: Dict[int, asyncio.Queue] = {}
+        self._chat_workers: Dict[int, asyncio.Task] = {}
+        # 媒体类型键 -> 已绑定的 Bot 发送方法
+        self._senders: Dict[str, Callable[..., Awaitable[Message]]] = {}
+        # 隐私设置不允许跳转的用户ID（按最近使用排序的有界集合）
+        self._privacy_restricted: "OrderedDict[int, None]" = OrderedDict()
+        # (会话ID, media_group_id) -> 待合并转发的 (媒体类型键, file_id, 说明文字)
+        self._albums: Dict[Tuple[int, str], List[Tuple[str, str, Optional[str]]]] = {}
     
     async def initialize(self) -> bool:
         """初始化机器人"""
         try:
             if not config.is_valid():
-                logger.error(f"[{PLUGIN_ID}] 配置无效，无法启动机器人")
+                logger.error("[%s] 配置无效，无法启动机器人", PLUGIN_ID)
                 return False
             
-            bot_token = config.bot_token
-            proxy_url = config.proxy
-            
-            builder = Application.builder().token(bot_token)
-            if proxy_url:
-                request = HTTPXRequest(proxy=proxy_url)
-                builder = builder.request(request)
-            
-            self.application = builder.build()
+            self.application = build_application(concurrent=True)
             self.bot = self.application.bot
+            if self.bot is None:
+                raise RuntimeError("Application 未创建 Bot 实例")
+            self._senders = {
+                key: getattr(self.bot, method) for key, method in MEDIA_SEND_METHODS.items()
+            }
             self._register_handlers()
             return True
             
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 机器人初始化失败: {e}", exc_info=True)
+            logger.error("[%s] 机器人初始化失败: %s", PLUGIN_ID, e, exc_info=True)
             return False
     
     def _register_handlers(self):
@@ -100,30 +157,18 @@ class TGBot:
             chat_id = update.effective_chat.id
             user = update.effective_user
             
-            welcome_msg = (
-                f"欢迎使用 Telegram 双向私聊机器人！\n\n"
-                f"你的用户ID: {chat_id}\n"
-                f"用户名: @{user.username if user.username else '未设置'}\n\n"
-                f"直接发送消息即可与管理员通信"
-            )
+            welcome_msg = WELCOME_TPL.format(chat_id=chat_id, username=user.username or "未设置")
             
-            reply_markup = None
-            if is_manager(chat_id):
-                keyboard = [
-                    [InlineKeyboardButton(
-                        text="📖 查看帮助",
-                        callback_data="show_help"
-                    )]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+            is_mgr = self._is_manager(chat_id)
+            reply_markup = HELP_REPLY_MARKUP if is_mgr else None
             
             await update.message.reply_text(welcome_msg, reply_markup=reply_markup)
             
-            if not self._is_manager(chat_id):
+            if not is_mgr:
                 await self._notify_manager(f"新用户启动机器人:\n用户ID: {chat_id}\n用户名: {user.username or '未设置'}")
             
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 处理 /start 命令失败: {e}", exc_info=True)
+            log_error(logger, "处理 /start 命令失败", e)
     
     async def _handle_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理 /help 命令（仅管理员）"""
@@ -208,6 +253,35 @@ class TGBot:
         """
         return extract_user_name_from_message(message_text)
     
+    def _build_forward_header(self, user, chat_id: int) -> Tuple[str, InlineKeyboardMarkup]:
+        """
+        构造转发给管理员的用户信息段落和内联键盘
+        
+        Args:
+            user: Telegram用户对象
+            chat_id: 用户聊天ID
+            
+        Returns:
+            Tuple[str, InlineKeyboardMarkup]: 用户信息段落、包含用户跳转与封禁按钮的键盘
+        """
+        user_info = format_user_info(user, chat_id)
+        
+        user_name = forward_user_name(user) or f"用户 {chat_id}"
+        
+        # 已知隐私设置不允许跳转的用户直接使用降级键盘
+        if chat_id in self._privacy_restricted:
+            return user_info, forward_markup(chat_id)
+        
+        # 先尝试使用包含用户跳转按钮的键盘
+        return user_info, forward_markup(chat_id, user_name)
+    
+    def _mark_privacy_restricted(self, chat_id: int):
+        """记录隐私设置不允许跳转的用户（超出上限时淘汰最早的记录）"""
+        self._privacy_restricted[chat_id] = None
+        self._privacy_restricted.move_to_end(chat_id)
+        if len(self._privacy_restricted) > _PRIVACY_CACHE_MAX:
+            self._privacy_restricted.popitem(last=False)
+    
     async def _handle_manager_reply(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """
         处理管理员的回复消息
@@ -230,17 +304,25 @@ class TGBot:
                 )
                 return
             
-            replied_text = reply_to_message.text or reply_to_message.caption or ""
-            
-            if not replied_text:
-                await message.reply_text(
-                    "❌ 无法识别要回复的用户。\n\n"
-                    "请确保回复的是机器人转发的用户消息（包含用户信息）。"
-                )
-                return
-            
-            target_user_id = self._extract_user_id_from_message(replied_text)
-            target_user_name = self._extract_user_name_from_message(replied_text)
+            forwarded = lookup_forward(reply_to_message.message_id)
+            if forwarded:
+                target_user_id, target_user_name = forwarded
+            else:
+                # 未记录的旧消息，从消息文本中解析用户信息
+                replied_text = reply_to_message.text or reply_to_message.caption or ""
+                
+                if not replied_text:
+                    await message.reply_text(
+                        "❌ 无法识别要回复的用户。\n\n"
+                        "请确保回复的是机器人转发的用户消息（包含用户信息）。"
+                    )
+                    return
+                
+                target_user_id = self._extract_user_id_from_message(replied_text)
+                target_user_name = self._extract_user_name_from_message(replied_text)
+                if target_user_id:
+                    # 记录解析结果，对同一条消息的后续回复不再重复解析
+                    remember_forward(reply_to_message.message_id, target_user_id, target_user_name or "")
             
             if not target_user_id:
                 await message.reply_text(
@@ -251,10 +333,12 @@ class TGBot:
             
             reply_text = message.text or message.caption or ""
             success = False
+            media_key, media_label, file_id = detect_media(message)
             
-            if message.photo or message.document or message.video or message.audio or message.voice:
+            if media_key:
                 success = await self._forward_media_to_user(
-                    message, 
+                    media_key,
+                    file_id,
                     target_user_id,
                     caption=reply_text if reply_text else None
                 )
@@ -270,17 +354,8 @@ class TGBot:
             if success:
                 display_name = target_user_name or f"用户 {target_user_id}"
                 content_parts = []
-                if message.photo or message.document or message.video or message.audio or message.voice:
-                    if message.photo:
-                        content_parts.append("图片")
-                    elif message.document:
-                        content_parts.append("文档")
-                    elif message.video:
-                        content_parts.append("视频")
-                    elif message.audio:
-                        content_parts.append("音频")
-                    elif message.voice:
-                        content_parts.append("语音")
+                if media_key:
+                    content_parts.append(media_label)
                 
                 if reply_text:
                     content_parts.append("文字")
@@ -298,7 +373,7 @@ class TGBot:
                 )
                 
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 处理管理员回复失败: {e}", exc_info=True)
+            log_error(logger, "处理管理员回复失败", e)
             try:
                 await update.message.reply_text("处理回复时发生错误，请稍后重试。")
             except:
@@ -310,232 +385,430 @@ class TGBot:
     
     async def _handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理文本消息"""
+        await self._handle_inbound(update, context, with_media=False)
+    
+    async def _handle_media(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """处理媒体消息（图片、文档等）"""
+        await self._handle_inbound(update, context, with_media=True)
+    
+    async def _handle_inbound(
+        self,
+        update: Update,
+        context: ContextTypes.DEFAULT_TYPE,
+        with_media: bool
+    ):
+        """
+        处理文本/媒体消息：管理员的消息交给回复逻辑，用户的消息转发给管理员
+        
+        Args:
+            update: Telegram更新对象
+            context: 上下文对象
+            with_media: 是否为媒体消息
+        """
         try:
             chat_id = update.effective_chat.id
-            user = update.effective_user
-            message_text = update.message.text
-            
-            if self._is_manager(chat_id):
-                await self._handle_manager_reply(update, context)
+            # 封禁用户最先返回，不读取消息内容
+            is_mgr = is_manager(chat_id)
+            if not is_mgr and config.is_blocked(chat_id):
                 return
             
-            if config.is_blocked(chat_id):
-                return
-            
-            # 检查是否包含封禁关键词
-            if self._contains_block_keywords(message_text):
+            message = update.message
+            if is_mgr:
+                # 管理员的媒体消息仅在回复用户消息时处理
+                if not with_media or message.reply_to_message:
+                    # 管理员的回复同样进入会话队列顺序处理，保证连续回复按发送顺序送达用户
+                    queued = self._enqueue(chat_id, lambda: self._handle_manager_reply(update, context))
+                    if not queued:
+                        context.application.create_task(
+                            self._send_drop_notice(chat_id, _MANAGER_DROP_NOTICE), update=update
+                        )
                 return
             
-            user_info = "\n\n" + "="*25 + f"\n用户ID: {chat_id}"
-            if user.first_name or user.last_name:
-                full_name = f"{user.first_name or ''} {user.last_name or ''}".strip()
-                user_info += f"\n姓名: {full_name}"
-            if user.username:
-                user_info += f"\n用户名: @{user.username}"
-            
-            if user.first_name:
-                user_name = user.first_name
-                if user.last_name:
-                    user_name += f" {user.last_name}"
-            elif user.username:
-                user_name = f"@{user.username}"
-            else:
-                user_name = f"用户 {chat_id}"
-            
-            forward_msg = message_text + user_info
+            user = update.effective_user
+            text = message.caption if with_media else message.text
             
-            # 先尝试创建包含用户跳转按钮的键盘
-            keyboard = [
-                [
-                    InlineKeyboardButton(
-                        text=user_name,
-                        url=f"tg://user?id={chat_id}"
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        text="🚫 封禁用户",
-                        callback_data=f"block_user:{chat_id}"
-                    )
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            # 检查文本或媒体说明是否包含封禁关键词
+            if contains_block_keywords(text or ""):
+                return
             
-            try:
-                await self._notify_manager(forward_msg, reply_markup=reply_markup)
-            except BadRequest as e:
-                # 如果用户隐私设置不允许跳转，则使用不包含跳转按钮的版本
-                if "Button_user_privacy_restricted" in str(e):
-                    keyboard_fallback = [
-                        [
-                            InlineKeyboardButton(
-                                text="🚫 封禁用户",
-                                callback_data=f"block_user:{chat_id}"
+            user_info, reply_markup = self._build_forward_header(user, chat_id)
+            user_name = forward_user_name(user)
+            queued = True
+            
+            # 转发给管理员的工作交给该用户的队列顺序处理，避免阻塞其他会话
+            if with_media:
+                media_type_key, media_type, file_id = detect_media(message)
+                ack = f"{media_type}已收到！(10s后自动销毁)"
+                if file_id:
+                    caption = f"{text}{user_info}" if text else f"收到来自用户的{media_type}{user_info}"
+                    if message.media_group_id and media_type_key in _ALBUM_MEDIA:
+                        # 相册消息合并后一次转发，仅对第一条回复确认消息
+                        is_first = self._collect_album_item(
+                            chat_id,
+                            message.media_group_id,
+                            (media_type_key, file_id, text),
+                            user_info,
+                            reply_markup,
+                            user_name
+                        )
+                        if not is_first:
+                            return
+                    else:
+                        queued = self._enqueue(
+                            chat_id,
+                            lambda: self._forward_user_media(
+                                chat_id, file_id, media_type_key, caption, reply_markup, user_name
                             )
-                        ]
-                    ]
-                    reply_markup_fallback = InlineKeyboardMarkup(keyboard_fallback)
-                    try:
-                        await self._notify_manager(forward_msg, reply_markup=reply_markup_fallback)
-                    except Exception as fallback_error:
-                        # 降级版本也失败，记录错误但不影响主流程
-                        logger.error(f"[{PLUGIN_ID}] 降级版本发送失败: {fallback_error}", exc_info=True)
-                else:
-                    raise
+                        )
+            else:
+                ack = "消息已收到！(10s后自动销毁)"
+                forward_msg = text + user_info
+                queued = self._enqueue(
+                    chat_id,
+                    lambda: self._forward_text_to_manager(chat_id, forward_msg, reply_markup, user_name)
+                )
             
-            # 发送确认消息，10秒后自动删除
-            confirm_msg = await update.message.reply_text("消息已收到！(10s后自动销毁)")
-            self._delete_message_after_delay(confirm_msg, delay=10)
+            # 确认消息在后台发送，处理器立即返回；未能转发时告知用户而不是确认收到
+            if queued:
+                context.application.create_task(self._send_confirmation(message, ack), update=update)
+            else:
+                context.application.create_task(self._send_drop_notice(chat_id), update=update)
             
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 处理消息失败: {e}", exc_info=True)
-            try:
-                await update.message.reply_text("处理消息时发生错误，请稍后重试。")
-            except:
-                pass
+            log_error(logger, "处理媒体消息失败" if with_media else "处理消息失败", e)
+            if not with_media:
+                try:
+                    await update.message.reply_text("处理消息时发生错误，请稍后重试。")
+                except:
+                    pass
     
-    async def _handle_media(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """处理媒体消息（图片、文档等）"""
+    async def _send_confirmation(self, message: Message, text: str):
+        """
+        向用户确认已收到消息
+        
+        优先给用户消息添加表情回应（一次请求，无需再删除）；
+        不支持回应时回复确认消息，10秒后自动删除
+        
+        Args:
+            message: 用户消息
+            text: 无法添加回应时使用的确认内容
+        """
         try:
-            chat_id = update.effective_chat.id
-            user = update.effective_user
-            message = update.message
-            
-            if self._is_manager(chat_id):
-                if message.reply_to_message:
-                    await self._handle_manager_reply(update, context)
-                    return
-                return
-            
-            if config.is_blocked(chat_id):
-                return
+            await message.set_reaction(_ACK_REACTION)
+            return
+        except (TelegramError, AttributeError) as e:
+            # AttributeError：python-telegram-bot 版本过旧，不支持 set_reaction
+            logger.debug("[%s] 添加确认回应失败，改用确认消息: %s", PLUGIN_ID, e)
+        try:
+            confirm_msg = await message.reply_text(text)
+        except TelegramError as e:
+            logger.warning("[%s] 发送确认消息失败: %s", PLUGIN_ID, e)
+            return
+        self._delete_message_after_delay(confirm_msg, delay=10)
+    
+    def _collect_album_item(
+        self,
+        chat_id: int,
+        media_group_id: str,
+        item: Tuple[str, str, Optional[str]],
+        user_info: str,
+        reply_markup: InlineKeyboardMarkup,
+        user_name: str
+    ) -> bool:
+        """
+        收集相册中的一条媒体，时间窗口结束后整体转发给管理员
+        
+        Args:
+            chat_id: 用户聊天ID
+            media_group_id: 相册ID
+            item: (媒体类型键, file_id, 说明文字)
+            user_info: 用户信息段落
+            reply_markup: 包含用户跳转与封禁按钮的键盘
+            user_name: 用户名
             
-            # 检查媒体消息的caption是否包含封禁关键词
-            caption = message.caption or ""
-            if self._contains_block_keywords(caption):
-                return
-            media_type = "未知类型"
-            media_type_key = None
-            file_id = None
-            if message.photo:
-                media_type = "图片"
-                media_type_key = "photo"
-                file_id = message.photo[-1].file_id
-            elif message.document:
-                media_type = "文档"
-                media_type_key = "document"
-                file_id = message.document.file_id
-            elif message.video:
-                media_type = "视频"
-                media_type_key = "video"
-                file_id = message.video.file_id
-            elif message.audio:
-                media_type = "音频"
-                media_type_key = "audio"
-                file_id = message.audio.file_id
-            elif message.voice:
-                media_type = "语音"
-                media_type_key = "voice"
-                file_id = message.voice.file_id
-            
-            user_info = "\n\n" + "="*25 + f"\n用户ID: {chat_id}"
-            if user.first_name or user.last_name:
-                full_name = f"{user.first_name or ''} {user.last_name or ''}".strip()
-                user_info += f"\n姓名: {full_name}"
-            if user.username:
-                user_info += f"\n用户名: @{user.username}"
-            
-            if user.first_name:
-                user_name = user.first_name
-                if user.last_name:
-                    user_name += f" {user.last_name}"
-            elif user.username:
-                user_name = f"@{user.username}"
+        Returns:
+            bool: 是否为该相册收到的第一条媒体
+        """
+        key = (chat_id, media_group_id)
+        album = self._albums.get(key)
+        if album is not None:
+            album.append(item)
+            return False
+        self._albums[key] = [item]
+        asyncio.get_running_loop().call_later(
+            _ALBUM_WINDOW, self._flush_album, key, user_info, reply_markup, user_name
+        )
+        return True
+    
+    def _flush_album(
+        self,
+        key: Tuple[int, str],
+        user_info: str,
+        reply_markup: InlineKeyboardMarkup,
+        user_name: str
+    ):
+        """时间窗口结束，将收集到的相册放入该用户的转发队列"""
+        items = self._albums.pop(key, None)
+        if not items or not self._started.is_set():
+            return
+        chat_id = key[0]
+        queued = self._enqueue(
+            chat_id,
+            lambda: self._forward_user_album(chat_id, items, user_info, reply_markup, user_name)
+        )
+        if not queued and self.application:
+            self.application.create_task(self._send_drop_notice(chat_id))
+    
+    async def _forward_user_album(
+        self,
+        chat_id: int,
+        items: List[Tuple[str, str, Optional[str]]],
+        user_info: str,
+        reply_markup: InlineKeyboardMarkup,
+        user_name: str = ""
+    ):
+        """
+        以 send_media_group 转发用户相册给管理员
+        
+        相册不支持内联键盘，发送后再附一条带用户信息和按钮的文本消息
+        """
+        manager_id = get_manager_id()
+        if manager_id is None:
+            return
+        
+        for start in range(0, len(items), _ALBUM_MAX):
+            chunk = items[start:start + _ALBUM_MAX]
+            if len(chunk) == 1:
+                # send_media_group 至少需要两项，单项时直接发送
+                media_type, file_id, caption = chunk[0]
+                sent = [await self._senders[media_type](
+                    chat_id=manager_id,
+                    caption=caption,
+                    **{media_type: file_id}
+                )]
             else:
-                user_name = f"用户 {chat_id}"
-            
-            caption = f"收到来自用户的{media_type}{user_info}"
-            if message.caption:
-                caption = f"{message.caption}{user_info}"
-            
-            # 先尝试创建包含用户跳转按钮的键盘
-            keyboard = [
-                [
-                    InlineKeyboardButton(
-                        text=user_name,
-                        url=f"tg://user?id={chat_id}"
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        text="🚫 封禁用户",
-                        callback_data=f"block_user:{chat_id}"
-                    )
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            try:
-                if file_id and media_type_key:
-                    await self._forward_media_to_manager(
-                        file_id, 
-                        media_type_key, 
-                        caption=caption,
-                        reply_markup=reply_markup
-                    )
-            except BadRequest as e:
-                # 如果用户隐私设置不允许跳转，则使用不包含跳转按钮的版本
-                if "Button_user_privacy_restricted" in str(e):
-                    keyboard_fallback = [
-                        [
-                            InlineKeyboardButton(
-                                text="🚫 封禁用户",
-                                callback_data=f"block_user:{chat_id}"
-                            )
-                        ]
+                sent = await self.bot.send_media_group(
+                    chat_id=manager_id,
+                    media=[
+                        _ALBUM_MEDIA[media_type](media=file_id, caption=caption)
+                        for media_type, file_id, caption in chunk
                     ]
-                    reply_markup_fallback = InlineKeyboardMarkup(keyboard_fallback)
-                    if file_id and media_type_key:
-                        try:
-                            await self._forward_media_to_manager(
-                                file_id, 
-                                media_type_key, 
-                                caption=caption,
-                                reply_markup=reply_markup_fallback
-                            )
-                        except Exception as fallback_error:
-                            # 降级版本也失败，记录错误但不影响主流程
-                            logger.error(f"[{PLUGIN_ID}] 降级版本发送失败: {fallback_error}", exc_info=True)
-                else:
-                    raise
-            except Exception as e:
-                logger.error(f"[{PLUGIN_ID}] 转发媒体失败: {e}", exc_info=True)
-            
-            confirm_msg = await update.message.reply_text(f"{media_type}已收到！(10s后自动销毁)")
-            self._delete_message_after_delay(confirm_msg, delay=10)
+                )
+            for msg in sent:
+                remember_forward(msg.message_id, chat_id, user_name)
+        
+        await self._forward_text_to_manager(
+            chat_id,
+            f"收到来自用户的相册（{len(items)}项）{user_info}",
+            reply_markup,
+            user_name
+        )
+    
+    def _enqueue(self, chat_id: int, coro_factory: Callable[[], Awaitable[Any]]) -> bool:
+        """
+        将任务放入对应会话的队列，由该会话的工作协程顺序执行
+        
+        同一会话内保持消息顺序，不同会话之间互不阻塞；队列已满时丢弃新任务
+        
+        Args:
+            chat_id: 会话ID
+            coro_factory: 返回待执行协程的工厂函数
             
-        except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 处理媒体消息失败: {e}", exc_info=True)
+        Returns:
+            bool: 是否已放入队列（队列已满被丢弃时返回False）
+        """
+        queue = self._chat_queues.get(chat_id)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=_CHAT_QUEUE_MAX)
+            self._chat_queues[chat_id] = queue
+        try:
+            queue.put_nowait(coro_factory)
+        except asyncio.QueueFull:
+            # 单个会话刷屏时限制积压，避免拖慢其他会话并无限占用内存
+            logger.warning("[%s] 会话 %s 待转发任务过多，丢弃新消息", PLUGIN_ID, chat_id)
+            return False
+        worker = self._chat_workers.get(chat_id)
+        if worker is None or worker.done():
+            self._chat_workers[chat_id] = asyncio.create_task(self._chat_worker(chat_id, queue))
+        return True
     
-    async def _notify_manager(self, message: str, reply_markup=None):
-        """通知管理员"""
-        manager_chatid = config.manager_chatid
-        if not manager_chatid:
-            return
+    async def _send_drop_notice(self, chat_id: int, text: str = _DROP_NOTICE):
+        """告知发送方消息因发送过于频繁未能转发"""
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text)
+        except TelegramError as e:
+            logger.warning("[%s] 发送丢弃提示失败: %s", PLUGIN_ID, e)
+    
+    async def _chat_worker(self, chat_id: int, queue: asyncio.Queue):
+        """会话工作协程：顺序执行队列中的任务，空闲超时后退出"""
+        try:
+            while True:
+                try:
+                    coro_factory = await asyncio.wait_for(queue.get(), timeout=_CHAT_WORKER_IDLE)
+                except asyncio.TimeoutError:
+                    break
+                try:
+                    await coro_factory()
+                except TelegramError as e:
+                    logger.warning("[%s] 会话 %s 转发失败: %s", PLUGIN_ID, chat_id, e)
+                except Exception as e:
+                    log_error(logger, "会话任务执行失败", e)
+        finally:
+            # 空闲退出时回收队列，若期间又有新任务则保留给下一个工作协程
+            if self._chat_workers.get(chat_id) is asyncio.current_task():
+                del self._chat_workers[chat_id]
+                if queue.empty():
+                    self._chat_queues.pop(chat_id, None)
+    
+    async def _send_with_privacy_fallback(
+        self,
+        chat_id: int,
+        send: Callable[[InlineKeyboardMarkup], Awaitable[Optional[Message]]],
+        reply_markup: InlineKeyboardMarkup,
+        user_name: str = ""
+    ):
+        """
+        发送转发消息给管理员，用户隐私设置不允许跳转时降级为仅含封禁按钮的键盘
         
-        await self.bot.send_message(
-            chat_id=int(manager_chatid),
+        降级过的用户会被记录，之后的消息直接使用降级键盘，省去一次失败的请求
+        
+        Args:
+            chat_id: 用户聊天ID
+            send: 以键盘为参数执行发送的函数
+            reply_markup: 包含用户跳转与封禁按钮的键盘
+            user_name: 用户名
+        """
+        sent = None
+        try:
+            sent = await send(reply_markup)
+        except BadRequest as e:
+            if "Button_user_privacy_restricted" not in str(e):
+                raise
+            self._mark_privacy_restricted(chat_id)
+            try:
+                sent = await send(forward_markup(chat_id))
+            except Exception as fallback_error:
+                # 降级版本也失败，记录错误但不影响主流程
+                logger.error("[%s] 降级版本发送失败: %s", PLUGIN_ID, fallback_error)
+        if sent:
+            remember_forward(sent.message_id, chat_id, user_name)
+    
+    async def _forward_text_to_manager(
+        self,
+        chat_id: int,
+        forward_msg: str,
+        reply_markup: InlineKeyboardMarkup,
+        user_name: str = ""
+    ):
+        """转发用户文本消息给管理员"""
+        await self._send_with_privacy_fallback(
+            chat_id,
+            lambda markup: self._notify_manager(forward_msg, reply_markup=markup),
+            reply_markup,
+            user_name
+        )
+    
+    async def _forward_user_media(
+        self,
+        chat_id: int,
+        file_id: str,
+        media_type_key: str,
+        caption: str,
+        reply_markup: InlineKeyboardMarkup,
+        user_name: str = ""
+    ):
+        """转发用户媒体消息给管理员"""
+        await self._send_with_privacy_fallback(
+            chat_id,
+            lambda markup: self._forward_media_to_manager(
+                file_id,
+                media_type_key,
+                caption=caption,
+                reply_markup=markup
+            ),
+            reply_markup,
+            user_name
+        )
+    
+    async def _notify_manager(self, message: str, reply_markup=None) -> Optional[Message]:
+        """
+        通知管理员
+        
+        不带键盘的纯文本通知进入队列，由后台任务合并发送；
+        带键盘的通知（用户消息转发）直接发送，以便调用方处理发送异常。
+        
+        Returns:
+            Optional[Message]: 直接发送时返回已发送的消息，进入队列时返回None
+        """
+        manager_id = get_manager_id()
+        if manager_id is None:
+            return None
+        
+        if reply_markup is None and self._notify_queue is not None:
+            try:
+                self._notify_queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._notify_queue.get_nowait()
+                self._notify_queue.put_nowait(message)
+                logger.warning("[%s] 管理员通知积压过多，已丢弃最早的通知", PLUGIN_ID)
+            return None
+        
+        return await self.bot.send_message(
+            chat_id=manager_id,
             text=message,
             reply_markup=reply_markup
         )
     
+    async def _notify_worker(self):
+        """后台合并发送纯文本管理员通知，减少突发流量下的请求数"""
+        while True:
+            batch = [await self._notify_queue.get()]
+            try:
+                while len(batch) < _NOTIFY_BATCH_MAX:
+                    batch.append(
+                        await asyncio.wait_for(self._notify_queue.get(), timeout=_NOTIFY_BATCH_WINDOW)
+                    )
+            except asyncio.TimeoutError:
+                pass
+            
+            manager_id = get_manager_id()
+            if manager_id is None:
+                continue
+            for text in self._coalesce_notifications(batch):
+                try:
+                    await self.bot.send_message(chat_id=manager_id, text=text)
+                except Exception as e:
+                    logger.error("[%s] 发送管理员通知失败: %s", PLUGIN_ID, e)
+    
+    @staticmethod
+    def _coalesce_notifications(batch: List[str]) -> List[str]:
+        """
+        将多条通知按长度上限合并
+        
+        Args:
+            batch: 待发送的通知列表
+            
+        Returns:
+            List[str]: 合并后的消息列表
+        """
+        merged = []
+        current = ""
+        for text in batch:
+            if current and len(current) + len(_NOTIFY_JOINER) + len(text) > _NOTIFY_MAX_LEN:
+                merged.append(current)
+                current = ""
+            current = f"{current}{_NOTIFY_JOINER}{text}" if current else text
+        if current:
+            merged.append(current)
+        return merged
+    
     async def _forward_media_to_manager(
         self, 
         file_id: str, 
         media_type: str, 
         caption: Optional[str] = None,
         reply_markup: Optional[InlineKeyboardMarkup] = None
-    ):
+    ) -> Optional[Message]:
         """
         转发媒体文件给管理员
         
@@ -544,55 +817,40 @@ class TGBot:
             media_type: 媒体类型（photo/document/video/audio/voice）
             caption: 可选的说明文字
             reply_markup: 可选的内联键盘
+            
+        Returns:
+            Optional[Message]: 已发送的消息，失败时返回None
         """
         try:
-            manager_chatid = config.manager_chatid
-            if not manager_chatid:
-                return
-            
-            chat_id = int(manager_chatid)
-            
-            if media_type == "photo":
-                await self.bot.send_photo(
-                    chat_id=chat_id, 
-                    photo=file_id,
-                    caption=caption,
-                    reply_markup=reply_markup
-                )
-            elif media_type == "document":
-                await self.bot.send_document(
-                    chat_id=chat_id, 
-                    document=file_id,
-                    caption=caption,
-                    reply_markup=reply_markup
-                )
-            elif media_type == "video":
-                await self.bot.send_video(
-                    chat_id=chat_id, 
-                    video=file_id,
-                    caption=caption,
-                    reply_markup=reply_markup
-                )
-            elif media_type == "audio":
-                await self.bot.send_audio(
-                    chat_id=chat_id, 
-                    audio=file_id,
-                    caption=caption,
-                    reply_markup=reply_markup
-                )
-            elif media_type == "voice":
-                await self.bot.send_voice(
-                    chat_id=chat_id, 
-                    voice=file_id,
-                    caption=caption,
-                    reply_markup=reply_markup
-                )
+            chat_id = get_manager_id()
+            if chat_id is None:
+                return None
+            
+            send = self._senders.get(media_type)
+            if not send:
+                return None
+            
+            return await send(
+                chat_id=chat_id,
+                caption=caption,
+                reply_markup=reply_markup,
+                **{media_type: file_id}
+            )
+        except BadRequest as e:
+            # 隐私限制交由调用方降级重试
+            if "Button_user_privacy_restricted" in str(e):
+                raise
+            logger.warning("[%s] 转发媒体给管理员失败: %s", PLUGIN_ID, e)
+        except TelegramError as e:
+            logger.warning("[%s] 转发媒体给管理员失败: %s", PLUGIN_ID, e)
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 转发媒体给管理员失败: {e}", exc_info=True)
+            log_error(logger, "转发媒体给管理员时发生未知错误", e)
+        return None
     
     async def _forward_media_to_user(
         self,
-        message: Message,
+        media_type: str,
+        file_id: str,
         user_id: int,
         caption: Optional[str] = None
     ) -> bool:
@@ -600,7 +858,8 @@ class TGBot:
         转发媒体消息给用户
         
         Args:
-            message: Telegram消息对象
+            media_type: 媒体类型（photo/document/video/audio/voice）
+            file_id: 媒体文件ID
             user_id: 目标用户ID
             caption: 可选的说明文字
             
@@ -608,90 +867,81 @@ class TGBot:
             bool: 是否发送成功
         """
         try:
-            if not self.bot:
-                logger.error(f"[{PLUGIN_ID}] 机器人未初始化")
+            send = self._senders.get(media_type)
+            if not send:
                 return False
             
-            if message.photo:
-                await self.bot.send_photo(
-                    chat_id=user_id,
-                    photo=message.photo[-1].file_id,
-                    caption=caption
-                )
-                return True
-            elif message.document:
-                await self.bot.send_document(
-                    chat_id=user_id,
-                    document=message.document.file_id,
-                    caption=caption
-                )
-                return True
-            elif message.video:
-                await self.bot.send_video(
-                    chat_id=user_id,
-                    video=message.video.file_id,
-                    caption=caption
-                )
-                return True
-            elif message.audio:
-                await self.bot.send_audio(
-                    chat_id=user_id,
-                    audio=message.audio.file_id,
-                    caption=caption
-                )
-                return True
-            elif message.voice:
-                await self.bot.send_voice(
-                    chat_id=user_id,
-                    voice=message.voice.file_id,
-                    caption=caption
-                )
-                return True
-            else:
-                return False
-                
+            await send(
+                chat_id=user_id,
+                caption=caption,
+                **{media_type: file_id}
+            )
+            return True
         except TelegramError as e:
-            logger.error(f"[{PLUGIN_ID}] 转发媒体给用户失败: {e}", exc_info=True)
+            logger.warning("[%s] 转发媒体给用户失败: %s", PLUGIN_ID, e)
             return False
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 转发媒体给用户时发生未知错误: {e}", exc_info=True)
+            log_error(logger, "转发媒体给用户时发生未知错误", e)
             return False
     
+    @property
+    def is_running(self) -> bool:
+        """是否已启动并在接收更新"""
+        return self._started.is_set()
+    
     async def start(self):
-        """启动机器人"""
-        if self._running:
-            return
-        
-        if not self.application:
-            if not await self.initialize():
+        """启动机器人（与 stop 互斥，重复调用只启动一次）"""
+        async with self._state_lock:
+            if self._started.is_set():
                 return
-        
-        try:
-            await self.application.initialize()
-            await self.application.start()
-            await self.application.updater.start_polling(
-                allowed_updates=Update.ALL_TYPES,
-                drop_pending_updates=True
-            )
-            self._running = True
-        except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 机器人启动失败: {e}", exc_info=True)
-            self._running = False
-            raise
+            
+            if not self.application:
+                if not await self.initialize():
+                    return
+            
+            try:
+                await self.application.initialize()
+                await self.application.start()
+                await start_updater(self.application)
+                self._notify_queue = asyncio.Queue(maxsize=_NOTIFY_QUEUE_MAX)
+                self._notify_task = asyncio.create_task(self._notify_worker())
+                self._started.set()
+            except Exception as e:
+                logger.error("[%s] 机器人启动失败: %s", PLUGIN_ID, e, exc_info=True)
+                raise
     
     async def stop(self):
         """停止机器人"""
-        if not self._running:
-            return
-        
-        try:
-            if self.application:
-                await self.application.updater.stop()
-                await self.application.stop()
-                await self.application.shutdown()
-            self._running = False
-        except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 停止机器人失败: {e}", exc_info=True)
+        async with self._state_lock:
+            if not self._started.is_set():
+                return
+            
+            # 先清除状态，停止期间不再接收新的转发任务
+            self._started.clear()
+            try:
+                tasks = list(self._chat_workers.values())
+                if self._notify_task:
+                    tasks.append(self._notify_task)
+                    self._notify_task = None
+                for task in tasks:
+                    task.cancel()
+                self._notify_queue = None
+                self._chat_workers.clear()
+                self._chat_queues.clear()
+                self._albums.clear()
+                # 在连接关闭前删除尚未到期的确认消息
+                await flush_pending_deletes()
+                if self.application:
+                    # 停止拉取更新后，Application 停止与后台任务的取消可以同时进行
+                    await self.application.updater.stop()
+                    results = await asyncio.gather(
+                        self.application.stop(), *tasks, return_exceptions=True
+                    )
+                    if isinstance(results[0], Exception):
+                        logger.error("[%s] 停止 Application 失败: %s", PLUGIN_ID, results[0])
+                    await self.application.shutdown()
+            except Exception as e:
+                logger.error("[%s] 停止机器人失败: %s", PLUGIN_ID, e, exc_info=True)
     
     async def send_message(self, chat_id: int, message: str) -> bool:
         """
@@ -705,22 +955,20 @@ class TGBot:
             bool: 是否发送成功
         """
         try:
-            if not self.bot:
-                logger.error(f"[{PLUGIN_ID}] 机器人未初始化")
-                return False
-            
             await self.bot.send_message(chat_id=chat_id, text=message)
             return True
         except TelegramError as e:
-            logger.error(f"[{PLUGIN_ID}] 发送消息失败: {e}", exc_info=True)
+            logger.warning("[%s] 发送消息失败: %s", PLUGIN_ID, e)
             return False
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 发送消息时发生未知错误: {e}", exc_info=True)
+            log_error(logger, "发送消息时发生未知错误", e)
             return False
 
 
 # 全局机器人实例
 bot_instance: Optional[TGBot] = None
+# 保护实例创建与初始化，避免并发调用重复构建 Application 与连接池
+_instance_lock = asyncio.Lock()
 
 
 def get_bot() -> Optional[TGBot]:
@@ -729,18 +977,20 @@ def get_bot() -> Optional[TGBot]:
 
 
 async def init_bot() -> bool:
-    """初始化机器人实例"""
+    """初始化机器人实例（并发调用时只初始化一次）"""
     global bot_instance
-    if bot_instance is None:
-        bot_instance = TGBot()
-    return await bot_instance.initialize()
+    async with _instance_lock:
+        if bot_instance is None:
+            bot_instance = TGBot()
+        if bot_instance.application is not None:
+            return True
+        return await bot_instance.initialize()
 
 
 async def start_bot():
     """启动机器人"""
-    global bot_instance
-    if bot_instance is None:
-        bot_instance = TGBot()
+    if not await init_bot():
+        return
     await bot_instance.start()
 
 
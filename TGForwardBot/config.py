@@ -1,19 +1,63 @@
 import os
+import re
+import mmap
 import json
+import hashlib
 import logging
+import threading
+from operator import itemgetter
 from pathlib import Path
-from typing import Optional, Dict, Any, List, Set
+from typing import Optional, Dict, Any, List, Set, Callable, Iterable, Tuple
 
 from notifyhub.plugins.utils import get_plugin_config
 
+try:
+    import orjson  # 可选依赖，存在时用于加速 JSON 读写
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+
+def _json_dumps(obj: Any) -> bytes:
+    """序列化为 UTF-8 编码的 JSON（缩进2格）"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def _json_loads(data: bytes) -> Any:
+    """解析 UTF-8 编码的 JSON"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_load_file(path: Path) -> Any:
+    """读取并解析 JSON 文件（使用 orjson 时通过内存映射直接解析，避免额外拷贝）"""
+    with open(path, "rb") as f:
+        if orjson is None:
+            return _json_loads(f.read())
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法映射
+            return _json_loads(f.read())
+        try:
+            with memoryview(mm) as view:
+                return orjson.loads(view)
+        finally:
+            mm.close()
+
 PLUGIN_ID = "TGForwardBot"
 
 
 class TGForwardBotConfig:
     """TG双向私聊机器人配置"""
     
+    # 为 True 时文件读写类错误日志附带完整堆栈（默认只记录单行错误信息）
+    DEBUG_TRACEBACKS = False
+    
     def __init__(self):
         self._config: Optional[Dict[str, Any]] = None
         self._workdir: Optional[str] = None
@@ -21,6 +65,16 @@ class TGForwardBotConfig:
         self._blocklist_file: Optional[Path] = None
         self._blocklist_cache: Optional[Set[int]] = None  # 用户ID集合（用于快速查找）
         self._blocklist_data_cache: Optional[List[Dict[str, Any]]] = None  # 完整数据（包含姓名）
+        self._blocklist_index: Optional[Dict[int, Dict[str, Any]]] = None  # user_id -> 用户信息
+        self._blocklist_sorted_ids: Optional[Tuple[int, ...]] = None  # 按用户ID排序的ID元组
+        self._blocklist_mtime: Optional[int] = None  # 缓存对应的 blocklist 文件修改时间（纳秒）
+        self._blocklist_hash: Optional[bytes] = None  # 最近一次写入内容的摘要（内容未变化时跳过写入）
+        self._lock = threading.RLock()  # 保护 blocklist 缓存的加载与写入
+        self._invalidate_hooks: List[Callable[[], None]] = []  # 配置失效时的回调
+        self._version = 0  # 配置版本号，每次重新加载递增
+        self._manager_chatid_int: Optional[int] = None  # 整数形式的管理员ChatID（加载配置时解析）
+        self._block_keywords_cache: Optional[List[str]] = None  # 解析后的封禁关键词（加载配置时解析）
+        self._block_keywords_pattern: Optional[re.Pattern] = None  # 封禁关键词正则（加载配置时编译）
         
         # 初始化目录和文件
         self._init_directories()
@@ -43,12 +97,12 @@ class TGForwardBotConfig:
             # 如果 blocklist 文件不存在，创建空文件
             if not self._blocklist_file.exists():
                 self._save_blocklist_data([])
-                logger.info(f"[{PLUGIN_ID}] 创建 blocklist 文件: {self._blocklist_file}")
+                logger.info("[%s] 创建 blocklist 文件: %s", PLUGIN_ID, self._blocklist_file)
             
-            logger.info(f"[{PLUGIN_ID}] 配置目录初始化完成: {self._conf_dir}")
+            logger.info("[%s] 配置目录初始化完成: %s", PLUGIN_ID, self._conf_dir)
             
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 初始化配置目录失败: {e}", exc_info=True)
+            logger.error("[%s] 初始化配置目录失败: %r", PLUGIN_ID, e, exc_info=self.DEBUG_TRACEBACKS)
             # 设置默认值，避免后续出错
             self._conf_dir = None
             self._blocklist_file = None
@@ -58,15 +112,53 @@ class TGForwardBotConfig:
         try:
             self._config = get_plugin_config(PLUGIN_ID) or {}
         except Exception as e:
-            logger.error(f"加载插件配置失败: {e}", exc_info=True)
+            logger.error("[%s] 加载插件配置失败: %r", PLUGIN_ID, e, exc_info=self.DEBUG_TRACEBACKS)
             self._config = {}
+        manager_chatid = self.manager_chatid
+        try:
+            self._manager_chatid_int = int(manager_chatid) if manager_chatid else None
+        except (TypeError, ValueError):
+            logger.warning("[%s] 管理员ChatID无效: %s", PLUGIN_ID, manager_chatid)
+            self._manager_chatid_int = None
+        self._block_keywords_cache = self._parse_block_keywords()
+        if self._block_keywords_cache:
+            # 长关键词在前，一次扫描完成所有关键词匹配
+            keywords = sorted(set(self._block_keywords_cache), key=len, reverse=True)
+            self._block_keywords_pattern = re.compile("|".join(map(re.escape, keywords)), re.IGNORECASE)
+        else:
+            self._block_keywords_pattern = None
     
     def reload(self):
         """重新加载配置"""
         self._load_config()
-        # 清除 blocklist 缓存，下次访问时重新加载
-        self._blocklist_cache = None
-        self._blocklist_data_cache = None
+        self._version += 1
+        # 仅当 blocklist 文件在磁盘上发生变化时才清除缓存，避免重复解析
+        with self._lock:
+            if self._blocklist_file_mtime() != self._blocklist_mtime:
+                self._blocklist_cache = None
+                self._blocklist_data_cache = None
+                self._blocklist_index = None
+                self._blocklist_sorted_ids = None
+                # 文件可能已被手动修改，不再以上次写入的摘要判断内容是否变化
+                self._blocklist_hash = None
+    
+    def add_invalidate_hook(self, hook: Callable[[], None]):
+        """注册配置失效回调（用于清除依赖配置的缓存）"""
+        self._invalidate_hooks.append(hook)
+    
+    def invalidate(self):
+        """重新加载配置并通知依赖方清除缓存"""
+        self.reload()
+        for hook in self._invalidate_hooks:
+            try:
+                hook()
+            except Exception as e:
+                logger.error("[%s] 执行配置失效回调失败: %s", PLUGIN_ID, e, exc_info=True)
+    
+    @property
+    def version(self) -> int:
+        """获取配置版本号（用于判断依赖配置的缓存是否过期）"""
+        return self._version
     
     @property
     def bot_token(self) -> str:
@@ -83,6 +175,11 @@ class TGForwardBotConfig:
         """获取管理员ChatID"""
         return self._config.get("manager_chatid", "") if self._config else ""
     
+    @property
+    def manager_chatid_int(self) -> Optional[int]:
+        """获取整数形式的管理员ChatID，未配置或无效时返回None"""
+        return self._manager_chatid_int
+    
     @property
     def group_chatid(self) -> str:
         """获取群组ChatID（用于群组话题模式）"""
@@ -97,17 +194,70 @@ class TGForwardBotConfig:
         return proxy if proxy else None
 
     @property
-    def block_keywords(self) -> Optional[List[str]]:
-        """获取封禁关键词"""
+    def concurrent_updates(self) -> int:
+        """获取并发处理的更新数量"""
+        if not self._config:
+            return 32
+        try:
+            return max(1, int(self._config.get("concurrent_updates") or 32))
+        except (TypeError, ValueError):
+            return 32
+    
+    @property
+    def bot_api_server(self) -> Optional[str]:
+        """获取自建 Bot API 服务器地址（如 http://127.0.0.1:8081）"""
         if not self._config:
             return None
-        block_keywords = self._config.get("block_keywords", "").strip()
+        bot_api_server = (self._config.get("bot_api_server") or "").strip().rstrip("/")
+        return bot_api_server if bot_api_server else None
+    
+    @property
+    def webhook_url(self) -> Optional[str]:
+        """获取 Webhook 地址（为空时使用轮询模式）"""
+        if not self._config:
+            return None
+        webhook_url = (self._config.get("webhook_url") or "").strip()
+        return webhook_url if webhook_url else None
+    
+    @property
+    def webhook_port(self) -> int:
+        """获取 Webhook 本地监听端口"""
+        if not self._config:
+            return 8443
+        try:
+            return int(self._config.get("webhook_port") or 8443)
+        except (TypeError, ValueError):
+            return 8443
+    
+    @property
+    def webhook_secret(self) -> Optional[str]:
+        """获取 Webhook 校验密钥"""
+        if not self._config:
+            return None
+        webhook_secret = (self._config.get("webhook_secret") or "").strip()
+        return webhook_secret if webhook_secret else None
+
+    def _parse_block_keywords(self) -> Optional[List[str]]:
+        """解析逗号分隔的封禁关键词配置"""
+        if not self._config:
+            return None
+        block_keywords = (self._config.get("block_keywords") or "").strip()
         if block_keywords:
             block_keywords = block_keywords.split(",")
             block_keywords = [keyword.strip() for keyword in block_keywords]
             block_keywords = [keyword for keyword in block_keywords if keyword]
-            return block_keywords
+            return block_keywords or None
         return None
+
+    @property
+    def block_keywords(self) -> Optional[List[str]]:
+        """获取封禁关键词"""
+        return self._block_keywords_cache
+    
+    @property
+    def block_keywords_pattern(self) -> Optional[re.Pattern]:
+        """获取封禁关键词正则（忽略大小写），未配置关键词时返回None"""
+        return self._block_keywords_pattern
     
     def is_valid(self) -> bool:
         """检查配置是否有效"""
@@ -117,6 +267,15 @@ class TGForwardBotConfig:
         """群组模式配置是否有效"""
         return bool(self.bot_token and self.group_chatid)
     
+    def _blocklist_file_mtime(self) -> Optional[int]:
+        """获取 blocklist 文件修改时间（纳秒），文件不存在时返回None"""
+        if not self._blocklist_file:
+            return None
+        try:
+            return self._blocklist_file.stat().st_mtime_ns
+        except OSError:
+            return None
+    
     def _load_blocklist(self) -> Set[int]:
         """
         加载封禁用户列表（返回用户ID集合，用于快速查找）
@@ -128,14 +287,10 @@ class TGForwardBotConfig:
         if self._blocklist_cache is not None:
             return self._blocklist_cache
         
-        # 加载完整数据
+        # 加载完整数据（同时构建用户ID集合）
         self._load_blocklist_data()
-        
-        # 从完整数据中提取用户ID集合
-        if self._blocklist_data_cache:
+        if self._blocklist_cache is None:
             self._blocklist_cache = {item["user_id"] for item in self._blocklist_data_cache}
-        else:
-            self._blocklist_cache = set()
         
         return self._blocklist_cache
     
@@ -149,40 +304,66 @@ class TGForwardBotConfig:
         if self._blocklist_data_cache is not None:
             return self._blocklist_data_cache
         
-        if not self._blocklist_file or not self._blocklist_file.exists():
-            self._blocklist_data_cache = []
-            return self._blocklist_data_cache
-        
-        try:
-            with open(self._blocklist_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
+        # 双重检查：未命中缓存时加锁后再次检查，避免并发重复加载
+        with self._lock:
+            if self._blocklist_data_cache is not None:
+                return self._blocklist_data_cache
+            
+            # 文件修改时间同时用于判断文件是否存在，省去额外的 exists() 调用
+            mtime = self._blocklist_file_mtime()
+            if mtime is None:
+                self._set_blocklist_caches([], set(), {})
+                return self._blocklist_data_cache
+            
+            # 磁盘内容未必与本进程上次写入的一致，下次保存时必须写入
+            self._blocklist_hash = None
+            try:
+                data = _json_load_file(self._blocklist_file)
                 
                 # 处理嵌套列表的情况（兼容格式错误）
-                if isinstance(data, list) and len(data) > 0:
+                if type(data) is list and data:
                     # 如果第一个元素是列表，说明是嵌套列表 [[...]]，需要展开
-                    if isinstance(data[0], list):
+                    if type(data[0]) is list:
                         data = data[0]
                 
+                data_list: List[Dict[str, Any]] = []
+                ids: Set[int] = set()
+                index: Dict[int, Dict[str, Any]] = {}
                 # 处理格式：包含 user_id 和 name 的对象列表
-                if isinstance(data, list) and len(data) > 0:
-                    if isinstance(data[0], dict) and "user_id" in data[0]:
-                        # 格式：[{"user_id": int, "name": str}, ...]
-                        self._blocklist_data_cache = [
-                            {"user_id": int(item["user_id"]), "name": str(item.get("name", ""))}
-                            for item in data
-                            if "user_id" in item
-                        ]
-                    else:
-                        self._blocklist_data_cache = []
-                else:
-                    self._blocklist_data_cache = []
+                if type(data) is list and data:
+                    if type(data[0]) is dict and "user_id" in data[0]:
+                        # 格式：[{"user_id": int, "name": str}, ...]，一次遍历同时构建列表、ID集合与索引
+                        for item in data:
+                            if "user_id" not in item:
+                                continue
+                            user_id = int(item["user_id"])
+                            entry = {"user_id": user_id, "name": str(item.get("name", ""))}
+                            data_list.append(entry)
+                            ids.add(user_id)
+                            index[user_id] = entry
+                
+                self._set_blocklist_caches(data_list, ids, index)
+                self._blocklist_mtime = mtime
+                logger.debug("[%s] 加载 blocklist 数据: %s 个用户", PLUGIN_ID, len(data_list))
+            except FileNotFoundError:
+                # 获取修改时间后文件被删除
+                self._set_blocklist_caches([], set(), {})
+            except Exception as e:
+                logger.error("[%s] 加载 blocklist 失败: %r", PLUGIN_ID, e, exc_info=self.DEBUG_TRACEBACKS)
+                self._set_blocklist_caches([], set(), {})
             
-            logger.debug(f"[{PLUGIN_ID}] 加载 blocklist 数据: {len(self._blocklist_data_cache)} 个用户")
-        except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 加载 blocklist 失败: {e}", exc_info=True)
-            self._blocklist_data_cache = []
-        
-        return self._blocklist_data_cache
+            return self._blocklist_data_cache
+    
+    def _set_blocklist_caches(
+        self,
+        data_list: List[Dict[str, Any]],
+        ids: Set[int],
+        index: Dict[int, Dict[str, Any]],
+    ):
+        """同时更新 blocklist 的完整数据、ID集合与索引缓存"""
+        self._blocklist_data_cache = data_list
+        self._blocklist_cache = ids
+        self._blocklist_index = index
     
     def _save_blocklist_data(self, blocklist_data: List[Dict[str, Any]]):
         """
@@ -192,38 +373,52 @@ class TGForwardBotConfig:
             blocklist_data: 用户信息列表，格式：[{"user_id": int, "name": str}, ...]
         """
         if not self._blocklist_file:
-            logger.error(f"[{PLUGIN_ID}] blocklist 文件路径未初始化")
+            logger.error("[%s] blocklist 文件路径未初始化", PLUGIN_ID)
             return False
         
-        try:
-            # 去重（基于 user_id）并排序
-            seen_ids = set()
-            unique_data = []
-            for item in blocklist_data:
-                user_id = int(item["user_id"])
-                if user_id not in seen_ids:
-                    seen_ids.add(user_id)
-                    unique_data.append({
+        with self._lock:
+            try:
+                # 去重（基于 user_id，后出现的姓名覆盖先前的）
+                merged: Dict[int, Dict[str, Any]] = {}
+                for item in blocklist_data:
+                    user_id = int(item["user_id"])
+                    merged[user_id] = {
                         "user_id": user_id,
                         "name": str(item.get("name", "")).strip()
-                    })
-            
-            # 按 user_id 排序
-            unique_data.sort(key=lambda x: x["user_id"])
-            
-            with open(self._blocklist_file, "w", encoding="utf-8") as f:
-                json.dump(unique_data, f, indent=2, ensure_ascii=False)
-            
-            # 更新缓存
-            self._blocklist_data_cache = unique_data
-            self._blocklist_cache = {item["user_id"] for item in unique_data}
-            
-            logger.info(f"[{PLUGIN_ID}] 保存 blocklist: {len(unique_data)} 个用户")
-            return True
-            
-        except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 保存 blocklist 失败: {e}", exc_info=True)
-            return False
+                    }
+                
+                # 按 user_id 排序
+                unique_data = sorted(merged.values(), key=itemgetter("user_id"))
+                
+                payload = _json_dumps(unique_data)
+                digest = hashlib.blake2b(payload, digest_size=16).digest()
+                changed = digest != self._blocklist_hash
+                if changed:
+                    # 先写临时文件再原子替换，避免写入中途崩溃导致文件损坏
+                    tmp_file = self._blocklist_file.with_suffix(".json.tmp")
+                    with open(tmp_file, "wb") as f:
+                        f.write(payload)
+                    os.replace(tmp_file, self._blocklist_file)
+                    self._blocklist_hash = digest
+                
+                # 更新缓存
+                self._set_blocklist_caches(
+                    unique_data,
+                    {item["user_id"] for item in unique_data},
+                    {item["user_id"]: item for item in unique_data},
+                )
+                self._blocklist_sorted_ids = tuple(item["user_id"] for item in unique_data)
+                self._blocklist_mtime = self._blocklist_file_mtime()
+                
+                if changed:
+                    logger.info("[%s] 保存 blocklist: %s 个用户", PLUGIN_ID, len(unique_data))
+                else:
+                    logger.debug("[%s] blocklist 内容未变化，跳过写入", PLUGIN_ID)
+                return True
+                
+            except Exception as e:
+                logger.error("[%s] 保存 blocklist 失败: %r", PLUGIN_ID, e, exc_info=self.DEBUG_TRACEBACKS)
+                return False
     
     def is_blocked(self, user_id: int) -> bool:
         """
@@ -235,7 +430,9 @@ class TGForwardBotConfig:
         Returns:
             bool: 是否被封禁
         """
-        blocklist = self._load_blocklist()
+        blocklist = self._blocklist_cache
+        if blocklist is None:
+            blocklist = self._load_blocklist()
         return user_id in blocklist
     
     def add_to_blocklist(self, user_id: int, name: str = "") -> bool:
@@ -249,25 +446,47 @@ class TGForwardBotConfig:
         Returns:
             bool: 是否添加成功
         """
-        blocklist_data = self._load_blocklist_data()
-        
-        # 检查是否已存在
-        for item in blocklist_data:
-            if item["user_id"] == user_id:
-                # 如果已存在但姓名不同，更新姓名
-                if name and item["name"] != name:
-                    item["name"] = name
-                    return self._save_blocklist_data(blocklist_data)
-                logger.warning(f"[{PLUGIN_ID}] 用户 {user_id} 已在封禁列表中")
-                return False
+        with self._lock:
+            if self.add_many_to_blocklist([(user_id, name)]):
+                return True
+            if user_id in self._load_blocklist():
+                logger.warning("[%s] 用户 %s 已在封禁列表中", PLUGIN_ID, user_id)
+            return False
+    
+    def add_many_to_blocklist(self, items: Iterable[Tuple[int, str]]) -> int:
+        """
+        批量添加用户到封禁列表（只写入一次文件）
         
-        # 添加新用户
-        blocklist_data.append({
-            "user_id": user_id,
-            "name": name.strip() if name else ""
-        })
+        已存在的用户仅在提供了不同姓名时更新姓名；缓存只在保存成功后替换，
+        中途出错或保存失败时缓存与文件保持一致
         
-        return self._save_blocklist_data(blocklist_data)
+        Args:
+            items: (用户ID, 用户姓名) 序列
+            
+        Returns:
+            int: 新增或更新姓名的用户数量，无变化或保存失败时返回0
+        """
+        # 读取、合并与保存在同一把锁内完成，避免并发修改互相覆盖
+        with self._lock:
+            # 在副本上合并：user_id -> 姓名
+            merged = {uid: item["name"] for uid, item in self.get_blocklist_index().items()}
+            changed = 0
+            try:
+                for user_id, name in items:
+                    user_id = int(user_id)
+                    name = str(name or "").strip()
+                    current = merged.get(user_id)
+                    if current is None or (name and current != name):
+                        merged[user_id] = name
+                        changed += 1
+            except (TypeError, ValueError) as e:
+                logger.error("[%s] 封禁用户数据无效: %r", PLUGIN_ID, e)
+                return 0
+            
+            if not changed:
+                return 0
+            blocklist_data = [{"user_id": uid, "name": name} for uid, name in merged.items()]
+            return changed if self._save_blocklist_data(blocklist_data) else 0
     
     def remove_from_blocklist(self, user_id: int) -> bool:
         """
@@ -279,17 +498,14 @@ class TGForwardBotConfig:
         Returns:
             bool: 是否移除成功
         """
-        blocklist_data = self._load_blocklist_data()
-        
-        # 查找并移除
-        original_count = len(blocklist_data)
-        blocklist_data = [item for item in blocklist_data if item["user_id"] != user_id]
-        
-        if len(blocklist_data) == original_count:
-            logger.warning(f"[{PLUGIN_ID}] 用户 {user_id} 不在封禁列表中")
-            return False
-        
-        return self._save_blocklist_data(blocklist_data)
+        with self._lock:
+            # 不在封禁列表中时直接返回，无需重建列表
+            if user_id not in self._load_blocklist():
+                logger.warning("[%s] 用户 %s 不在封禁列表中", PLUGIN_ID, user_id)
+                return False
+            
+            blocklist_data = [item for item in self._load_blocklist_data() if item["user_id"] != user_id]
+            return self._save_blocklist_data(blocklist_data)
     
     def get_blocklist(self) -> List[Dict[str, Any]]:
         """
@@ -300,6 +516,17 @@ class TGForwardBotConfig:
         """
         return self._load_blocklist_data()
     
+    def get_blocklist_index(self) -> Dict[int, Dict[str, Any]]:
+        """
+        获取以用户ID为键的封禁用户索引
+        
+        Returns:
+            Dict[int, Dict[str, Any]]: 封禁用户索引，格式：{user_id: {"user_id": int, "name": str}}
+        """
+        if self._blocklist_index is None:
+            self._blocklist_index = {item["user_id"]: item for item in self._load_blocklist_data()}
+        return self._blocklist_index
+    
     def get_blocklist_user_ids(self) -> List[int]:
         """
         获取封禁用户ID列表（兼容旧接口）
@@ -307,8 +534,10 @@ class TGForwardBotConfig:
         Returns:
             List[int]: 封禁用户ID列表
         """
-        blocklist = self._load_blocklist()
-        return sorted(list(blocklist))
+        if self._blocklist_sorted_ids is None:
+            # 文件中的顺序不保证有序，首次访问时排序一次
+            self._blocklist_sorted_ids = tuple(sorted(self._load_blocklist()))
+        return list(self._blocklist_sorted_ids)
     
     @property
     def conf_dir(self) -> Optional[Path]:
@@ -321,6 +550,25 @@ class TGForwardBotConfig:
         return self._blocklist_file
 
 
-# 全局配置实例
-config = TGForwardBotConfig()
+# 全局配置实例（首次访问时创建，导入本模块时不进行文件读写）
+_config_instance: Optional[TGForwardBotConfig] = None
+_config_instance_lock = threading.Lock()
+
+
+def get_config() -> TGForwardBotConfig:
+    """获取全局配置实例（首次调用时创建）"""
+    global _config_instance
+    inst = _config_instance
+    if inst is None:
+        with _config_instance_lock:
+            inst = _config_instance
+            if inst is None:
+                _config_instance = inst = TGForwardBotConfig()
+    return inst
+
 
+def __getattr__(name: str) -> Any:
+    """兼容 `from .config import config`：按需创建全局配置实例"""
+    if name == "config":
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,13 +1,14 @@
 """
 Telegram 群组话题转发模式
 """
+import os
 import json
 import logging
 import asyncio
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Callable, Awaitable
 
-from telegram import Update, Bot, InlineKeyboardMarkup, InlineKeyboardButton, Message
+from telegram import Update, Bot, InlineKeyboardMarkup, Message
 from telegram.ext import (
     Application,
     MessageHandler,
@@ -16,25 +17,41 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
-from telegram.request import HTTPXRequest
 from telegram.error import TelegramError, BadRequest
 
+try:
+    import orjson  # 可选依赖，存在时用于加速话题映射读写
+except ImportError:
+    orjson = None
+
 from .config import config
 from .utils import (
+    build_application,
+    start_updater,
+    detect_media,
+    format_user_info,
+    forward_markup,
+    MEDIA_SEND_METHODS,
     contains_block_keywords,
     delete_message_after_delay,
+    flush_pending_deletes,
     handle_help_command,
     handle_status_command,
     handle_block_list_command,
-    show_block_list,
     is_manager,
+    log_error,
     handle_callback_query_common,
+    HELP_REPLY_MARKUP,
+    WELCOME_TPL,
 )
 
 logger = logging.getLogger(__name__)
 
 PLUGIN_ID = "TGForwardBot"
 
+# 话题映射落盘间隔（秒）：新建话题只标记为待保存，由后台任务合并写入
+_TOPIC_SAVE_INTERVAL = 5
+
 
 class TGGroupBot:
     """群组话题双向转发机器人"""
@@ -43,38 +60,42 @@ class TGGroupBot:
         self.application: Optional[Application] = None
         self.bot: Optional[Bot] = None
         self.group_chatid: Optional[int] = None
-        self._running = False
+        # 启停互斥锁与运行状态（可 await self._started.wait() 等待启动完成）
+        self._state_lock = asyncio.Lock()
+        self._started = asyncio.Event()
         
         # user_id -> message_thread_id
         self._user_topic_map: Dict[int, int] = {}
         # message_thread_id -> user_id
         self._topic_user_map: Dict[int, int] = {}
         self._topic_map_file: Optional[Path] = None
+        # 话题映射是否有未保存的修改，以及负责定期保存的后台任务
+        self._topic_map_dirty = False
+        self._topic_save_stop = asyncio.Event()
+        self._topic_save_task: Optional[asyncio.Task] = None
+        # 媒体类型键 -> 已绑定的 Bot 发送方法
+        self._senders: Dict[str, Callable[..., Awaitable[Message]]] = {}
     
     async def initialize(self) -> bool:
         """初始化群组模式机器人"""
         try:
             if not config.is_group_mode_valid():
-                logger.error(f"[{PLUGIN_ID}] 群组模式配置无效，无法启动机器人")
+                logger.error("[%s] 群组模式配置无效，无法启动机器人", PLUGIN_ID)
                 return False
             
             self.group_chatid = int(config.group_chatid)
-            proxy_url = config.proxy
-            
-            builder = Application.builder().token(config.bot_token)
-            if proxy_url:
-                request = HTTPXRequest(proxy=proxy_url)
-                builder = builder.request(request)
-            
-            self.application = builder.build()
+            self.application = build_application()
             self.bot = self.application.bot
+            self._senders = {
+                key: getattr(self.bot, method) for key, method in MEDIA_SEND_METHODS.items()
+            }
             
             self._init_topic_store()
             self._load_topic_map()
             self._register_handlers()
             return True
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 群组模式初始化失败: {e}", exc_info=True)
+            logger.error("[%s] 群组模式初始化失败: %s", PLUGIN_ID, e, exc_info=True)
             return False
     
     def _init_topic_store(self):
@@ -87,7 +108,7 @@ class TGGroupBot:
                 conf_dir.mkdir(parents=True, exist_ok=True)
             self._topic_map_file = Path(conf_dir) / "group_topics.json"
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 初始化话题存储失败: {e}", exc_info=True)
+            logger.error("[%s] 初始化话题存储失败: %s", PLUGIN_ID, e, exc_info=True)
             self._topic_map_file = None
     
     def _load_topic_map(self):
@@ -97,29 +118,74 @@ class TGGroupBot:
             self._topic_user_map = {}
             return
         try:
-            with open(self._topic_map_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                if isinstance(data, dict):
-                    self._user_topic_map = {int(k): int(v) for k, v in data.get("user_to_topic", {}).items()}
-                    self._topic_user_map = {int(k): int(v) for k, v in data.get("topic_to_user", {}).items()}
+            with open(self._topic_map_file, "rb") as f:
+                raw = f.read()
+            data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+            if isinstance(data, dict):
+                # JSON 对象的键均为字符串，统一转换为整数
+                self._user_topic_map = {int(k): int(v) for k, v in data.get("user_to_topic", {}).items()}
+                self._topic_user_map = {int(k): int(v) for k, v in data.get("topic_to_user", {}).items()}
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 加载话题映射失败: {e}", exc_info=True)
+            logger.error("[%s] 加载话题映射失败: %s", PLUGIN_ID, e, exc_info=True)
             self._user_topic_map = {}
             self._topic_user_map = {}
     
-    def _save_topic_map(self):
-        """保存话题映射到文件"""
+    def _save_topic_map(self, payload: Optional[Dict[str, Dict[int, int]]] = None) -> bool:
+        """
+        保存话题映射到文件
+        
+        Args:
+            payload: 待保存的映射快照，为空时使用当前映射
+            
+        Returns:
+            bool: 是否保存成功
+        """
         if not self._topic_map_file:
-            return
+            return True
         try:
-            payload = {
-                "user_to_topic": self._user_topic_map,
-                "topic_to_user": self._topic_user_map,
-            }
-            with open(self._topic_map_file, "w", encoding="utf-8") as f:
-                json.dump(payload, f, indent=2, ensure_ascii=False)
+            if payload is None:
+                payload = {
+                    "user_to_topic": self._user_topic_map,
+                    "topic_to_user": self._topic_user_map,
+                }
+            if orjson is not None:
+                # OPT_NON_STR_KEYS 允许直接序列化整数键
+                raw = orjson.dumps(payload, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+            else:
+                raw = json.dumps(payload, indent=2, ensure_ascii=False).encode("utf-8")
+            # 先写临时文件再原子替换，避免写入中途崩溃导致文件损坏
+            tmp_file = self._topic_map_file.with_suffix(".json.tmp")
+            with open(tmp_file, "wb") as f:
+                f.write(raw)
+            os.replace(tmp_file, self._topic_map_file)
+            return True
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 保存话题映射失败: {e}", exc_info=True)
+            logger.error("[%s] 保存话题映射失败: %s", PLUGIN_ID, e, exc_info=True)
+            return False
+    
+    async def _flush_topic_map(self):
+        """将待保存的话题映射写入文件（在线程池中执行，避免阻塞事件循环）"""
+        if not self._topic_map_dirty:
+            return
+        self._topic_map_dirty = False
+        # 在事件循环中复制快照，避免写入线程遍历时映射被修改
+        payload = {
+            "user_to_topic": dict(self._user_topic_map),
+            "topic_to_user": dict(self._topic_user_map),
+        }
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(None, self._save_topic_map, payload):
+            # 保存失败，保留待保存标记以便下次重试
+            self._topic_map_dirty = True
+    
+    async def _topic_save_worker(self):
+        """定期保存话题映射，收到停止信号后执行最后一次保存并退出"""
+        while not self._topic_save_stop.is_set():
+            try:
+                await asyncio.wait_for(self._topic_save_stop.wait(), timeout=_TOPIC_SAVE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            await self._flush_topic_map()
     
     def _register_handlers(self):
         """注册消息处理器"""
@@ -220,13 +286,7 @@ class TGGroupBot:
     
     def _build_user_info(self, chat_id: int, user) -> str:
         """构造用户信息段落"""
-        info = "\n\n" + "=" * 25 + f"\n用户ID: {chat_id}"
-        if user and (user.first_name or user.last_name):
-            full_name = f"{user.first_name or ''} {user.last_name or ''}".strip()
-            info += f"\n姓名: {full_name}"
-        if user and user.username:
-            info += f"\n用户名: @{user.username}"
-        return info
+        return format_user_info(user, chat_id)
     
     async def _ensure_topic(self, user) -> Optional[int]:
         """获取或创建对应用户的话题，并返回 message_thread_id"""
@@ -243,13 +303,13 @@ class TGGroupBot:
             thread_id = result.message_thread_id
             self._user_topic_map[user_id] = thread_id
             self._topic_user_map[thread_id] = user_id
-            self._save_topic_map()
+            self._topic_map_dirty = True
             return thread_id
         except TelegramError as e:
-            logger.error(f"[{PLUGIN_ID}] 创建话题失败: {e}", exc_info=True)
+            log_error(logger, "创建话题失败", e)
             return None
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 创建话题时发生未知错误: {e}", exc_info=True)
+            log_error(logger, "创建话题时发生未知错误", e)
             return None
     
     async def _handle_user_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -259,7 +319,7 @@ class TGGroupBot:
             user = update.effective_user
             text = update.message.text
             
-            if config.is_blocked(chat_id) or self._contains_block_keywords(text):
+            if config.is_blocked(chat_id) or contains_block_keywords(text):
                 return
             
             thread_id = await self._ensure_topic(user)
@@ -270,9 +330,7 @@ class TGGroupBot:
             user_info = self._build_user_info(chat_id, user)
             forward_text = text + user_info
             
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton(text="🚫 封禁用户", callback_data=f"block_user:{chat_id}")]
-            ])
+            keyboard = forward_markup(chat_id)
             
             await self.bot.send_message(
                 chat_id=self.group_chatid,
@@ -284,7 +342,7 @@ class TGGroupBot:
             confirm = await update.message.reply_text("消息已转发至管理员。(10s后自动销毁)")
             self._delete_message_after_delay(confirm, delay=10)
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 处理用户文本失败: {e}", exc_info=True)
+            log_error(logger, "处理用户文本失败", e)
             try:
                 await update.message.reply_text("处理消息时发生错误，请稍后再试。")
             except:
@@ -292,7 +350,7 @@ class TGGroupBot:
     
     async def _handle_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """管理员 /help"""
-        logger.info(f"[{PLUGIN_ID}] 处理 /help 命令")
+        logger.info("[%s] 处理 /help 命令", PLUGIN_ID)
         await handle_help_command(update, context)
     
     async def _handle_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -309,30 +367,18 @@ class TGGroupBot:
             chat_id = update.effective_chat.id
             user = update.effective_user
             
-            welcome_msg = (
-                f"欢迎使用 Telegram 双向私聊机器人！\n\n"
-                f"你的用户ID: {chat_id}\n"
-                f"用户名: @{user.username if user.username else '未设置'}\n\n"
-                f"直接发送消息即可与管理员通信"
-            )
+            welcome_msg = WELCOME_TPL.format(chat_id=chat_id, username=user.username or "未设置")
             
-            reply_markup = None
-            if is_manager(chat_id):
-                keyboard = [
-                    [InlineKeyboardButton(
-                        text="📖 查看帮助",
-                        callback_data="show_help"
-                    )]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+            is_mgr = self._is_manager(chat_id)
+            reply_markup = HELP_REPLY_MARKUP if is_mgr else None
             
             await update.message.reply_text(welcome_msg, reply_markup=reply_markup)
             
-            if not self._is_manager(chat_id):
+            if not is_mgr:
                 await self._notify_manager(f"新用户启动机器人:\n用户ID: {chat_id}\n用户名: {user.username or '未设置'}")
             
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 处理 /start 命令失败: {e}", exc_info=True)
+            log_error(logger, "处理 /start 命令失败", e)
     
     async def _handle_user_media(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理私聊媒体消息并转发到群组话题"""
@@ -342,7 +388,7 @@ class TGGroupBot:
             message = update.message
             
             caption = message.caption or ""
-            if config.is_blocked(chat_id) or self._contains_block_keywords(caption):
+            if config.is_blocked(chat_id) or contains_block_keywords(caption):
                 return
             
             thread_id = await self._ensure_topic(user)
@@ -353,76 +399,47 @@ class TGGroupBot:
             user_info = self._build_user_info(chat_id, user)
             caption_to_send = caption + user_info if caption else f"收到媒体消息{user_info}"
             
-            keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton(text="🚫 封禁用户", callback_data=f"block_user:{chat_id}")]
-            ])
+            keyboard = forward_markup(chat_id)
             
-            await self._forward_media_to_group(
-                message=message,
-                caption=caption_to_send,
-                thread_id=thread_id,
-                reply_markup=keyboard
-            )
+            media_type, _, file_id = detect_media(message)
+            if media_type:
+                await self._forward_media_to_group(
+                    media_type,
+                    file_id,
+                    caption=caption_to_send,
+                    thread_id=thread_id,
+                    reply_markup=keyboard
+                )
             
             confirm = await message.reply_text("媒体已转发至管理员话题。(10s后自动销毁)")
             self._delete_message_after_delay(confirm, delay=10)
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 处理用户媒体失败: {e}", exc_info=True)
+            log_error(logger, "处理用户媒体失败", e)
     
     async def _forward_media_to_group(
         self,
-        message: Message,
+        media_type: str,
+        file_id: str,
         caption: str,
         thread_id: int,
         reply_markup: Optional[InlineKeyboardMarkup] = None
     ):
         """将媒体转发到群组话题"""
         try:
-            if message.photo:
-                await self.bot.send_photo(
+            send = self._senders.get(media_type)
+            if send:
+                await send(
                     chat_id=self.group_chatid,
-                    photo=message.photo[-1].file_id,
                     caption=caption,
                     message_thread_id=thread_id,
-                    reply_markup=reply_markup
-                )
-            elif message.document:
-                await self.bot.send_document(
-                    chat_id=self.group_chatid,
-                    document=message.document.file_id,
-                    caption=caption,
-                    message_thread_id=thread_id,
-                    reply_markup=reply_markup
-                )
-            elif message.video:
-                await self.bot.send_video(
-                    chat_id=self.group_chatid,
-                    video=message.video.file_id,
-                    caption=caption,
-                    message_thread_id=thread_id,
-                    reply_markup=reply_markup
-                )
-            elif message.audio:
-                await self.bot.send_audio(
-                    chat_id=self.group_chatid,
-                    audio=message.audio.file_id,
-                    caption=caption,
-                    message_thread_id=thread_id,
-                    reply_markup=reply_markup
-                )
-            elif message.voice:
-                await self.bot.send_voice(
-                    chat_id=self.group_chatid,
-                    voice=message.voice.file_id,
-                    caption=caption,
-                    message_thread_id=thread_id,
-                    reply_markup=reply_markup
+                    reply_markup=reply_markup,
+                    **{media_type: file_id}
                 )
         except BadRequest as e:
             # 部分媒体可能触发隐私限制，直接记录错误
-            logger.error(f"[{PLUGIN_ID}] 发送媒体到群组失败: {e}", exc_info=True)
+            log_error(logger, "发送媒体到群组失败", e)
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 发送媒体到群组出现异常: {e}", exc_info=True)
+            log_error(logger, "发送媒体到群组出现异常", e)
     
     async def _handle_group_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """处理群组话题中的管理员消息并转发给对应用户"""
@@ -446,45 +463,38 @@ class TGGroupBot:
             # 管理员 -> 用户
             text = message.text or message.caption or ""
             sent = False
-            if message.photo or message.document or message.video or message.audio or message.voice:
-                sent = await self._forward_media_to_user(message, user_id, caption=text if text else None)
+            media_type, _, file_id = detect_media(message)
+            if media_type:
+                sent = await self._forward_media_to_user(
+                    media_type, file_id, user_id, caption=text if text else None
+                )
             elif text:
                 sent = await self.send_message(user_id, text)
             
             if not sent:
                 await message.reply_text("转发失败，用户可能已屏蔽机器人。")
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 处理群组消息失败: {e}", exc_info=True)
+            log_error(logger, "处理群组消息失败", e)
     
     async def _forward_media_to_user(
         self,
-        message: Message,
+        media_type: str,
+        file_id: str,
         user_id: int,
         caption: Optional[str] = None
     ) -> bool:
         """将群组中的媒体转发给用户"""
         try:
-            if message.photo:
-                await self.bot.send_photo(chat_id=user_id, photo=message.photo[-1].file_id, caption=caption)
-                return True
-            if message.document:
-                await self.bot.send_document(chat_id=user_id, document=message.document.file_id, caption=caption)
-                return True
-            if message.video:
-                await self.bot.send_video(chat_id=user_id, video=message.video.file_id, caption=caption)
-                return True
-            if message.audio:
-                await self.bot.send_audio(chat_id=user_id, audio=message.audio.file_id, caption=caption)
-                return True
-            if message.voice:
-                await self.bot.send_voice(chat_id=user_id, voice=message.voice.file_id, caption=caption)
-                return True
-            return False
+            send = self._senders.get(media_type)
+            if not send:
+                return False
+            await send(chat_id=user_id, caption=caption, **{media_type: file_id})
+            return True
         except TelegramError as e:
-            logger.error(f"[{PLUGIN_ID}] 向用户转发媒体失败: {e}", exc_info=True)
+            log_error(logger, "向用户转发媒体失败", e)
             return False
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 向用户转发媒体出现未知错误: {e}", exc_info=True)
+            log_error(logger, "向用户转发媒体出现未知错误", e)
             return False
     
     async def _handle_callback_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -497,48 +507,63 @@ class TGGroupBot:
             await self.bot.send_message(chat_id=chat_id, text=message)
             return True
         except TelegramError as e:
-            logger.error(f"[{PLUGIN_ID}] 发送消息失败: {e}", exc_info=True)
+            log_error(logger, "发送消息失败", e)
             return False
         except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 发送消息出现未知错误: {e}", exc_info=True)
+            log_error(logger, "发送消息出现未知错误", e)
             return False
     
+    @property
+    def is_running(self) -> bool:
+        """是否已启动并在接收更新"""
+        return self._started.is_set()
+    
     async def start(self):
-        """启动群组模式"""
-        if self._running:
-            return
-        if not self.application:
-            if not await self.initialize():
+        """启动群组模式（与 stop 互斥，重复调用只启动一次）"""
+        async with self._state_lock:
+            if self._started.is_set():
                 return
-        try:
-            await self.application.initialize()
-            await self.application.start()
-            await self.application.updater.start_polling(
-                allowed_updates=Update.ALL_TYPES,
-                drop_pending_updates=True
-            )
-            self._running = True
-        except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 群组模式启动失败: {e}", exc_info=True)
-            self._running = False
-            raise
+            if not self.application:
+                if not await self.initialize():
+                    return
+            try:
+                await self.application.initialize()
+                await self.application.start()
+                await start_updater(self.application)
+                self._topic_save_stop.clear()
+                self._topic_save_task = asyncio.create_task(self._topic_save_worker())
+                self._started.set()
+            except Exception as e:
+                logger.error("[%s] 群组模式启动失败: %s", PLUGIN_ID, e, exc_info=True)
+                raise
     
     async def stop(self):
         """停止群组模式"""
-        if not self._running:
-            return
-        try:
-            if self.application:
-                await self.application.updater.stop()
-                await self.application.stop()
-                await self.application.shutdown()
-            self._running = False
-        except Exception as e:
-            logger.error(f"[{PLUGIN_ID}] 群组模式停止失败: {e}", exc_info=True)
+        async with self._state_lock:
+            if not self._started.is_set():
+                return
+            self._started.clear()
+            try:
+                # 在连接关闭前删除尚未到期的确认消息
+                await flush_pending_deletes()
+                if self.application:
+                    await self.application.updater.stop()
+                    await self.application.stop()
+                    await self.application.shutdown()
+            except Exception as e:
+                logger.error("[%s] 群组模式停止失败: %s", PLUGIN_ID, e, exc_info=True)
+            finally:
+                # 处理器全部结束后再通知保存任务退出，保证最后一次写入包含所有新建话题
+                if self._topic_save_task:
+                    self._topic_save_stop.set()
+                    await self._topic_save_task
+                    self._topic_save_task = None
 
 
 # 全局实例
 group_bot_instance: Optional[TGGroupBot] = None
+# 保护实例创建与初始化，避免并发调用重复构建 Application 与连接池
+_instance_lock = asyncio.Lock()
 
 
 def get_group_bot() -> Optional[TGGroupBot]:
@@ -547,18 +572,20 @@ def get_group_bot() -> Optional[TGGroupBot]:
 
 
 async def init_group_bot() -> bool:
-    """初始化群组模式机器人实例"""
+    """初始化群组模式机器人实例（并发调用时只初始化一次）"""
     global group_bot_instance
-    if group_bot_instance is None:
-        group_bot_instance = TGGroupBot()
-    return await group_bot_instance.initialize()
+    async with _instance_lock:
+        if group_bot_instance is None:
+            group_bot_instance = TGGroupBot()
+        if group_bot_instance.application is not None:
+            return True
+        return await group_bot_instance.initialize()
 
 
 async def start_group_bot():
     """启动群组模式机器人"""
-    global group_bot_instance
-    if group_bot_instance is None:
-        group_bot_instance = TGGroupBot()
+    if not await init_group_bot():
+        return
     await group_bot_instance.start()
 
 
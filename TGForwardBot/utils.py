@@ -2,27 +2,383 @@
 可复用的工具函数（私聊/群组模式共用）
 """
 import asyncio
+import functools
+import heapq
+import itertools
 import logging
 import re
-from typing import Optional
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, Union
 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Message
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Message, Update
+from telegram.error import BadRequest, RetryAfter
+from telegram.ext import AIORateLimiter, Application, BaseRateLimiter
+from telegram.request import HTTPXRequest
+
+try:
+    import ahocorasick  # 可选依赖：pyahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import h2  # noqa: F401  可选依赖：安装 httpx[http2] 后发送请求使用 HTTP/2
+    _HTTP_VERSION = "2"
+except ImportError:
+    _HTTP_VERSION = "1.1"
+
+try:
+    import tornado  # noqa: F401  可选依赖：Webhook 模式需安装 python-telegram-bot[webhooks]
+except ImportError:
+    tornado = None
 
 from .config import config
 
 logger = logging.getLogger(__name__)
 
+PLUGIN_ID = "TGForwardBot"
 
-def is_manager(chat_id: int) -> bool:
-    """判断是否管理员"""
+_ERROR_TRACEBACK_INTERVAL = 60  # 同类错误输出完整堆栈的最小间隔（秒）
+_error_logged: Dict[str, float] = {}  # 错误描述 -> 上次输出完整堆栈的时间
+
+# 转发消息中用户信息的解析规则
+_RE_USER_ID = re.compile(r"用户ID:\s*(\d+)")
+_RE_NAME = re.compile(r"姓名:\s*([^\n]+)")
+_RE_USERNAME = re.compile(r"用户名:\s*@?([^\n]+)")
+
+# HTTP 连接池大小
+_SEND_POOL_SIZE = 256
+_UPDATES_POOL_SIZE = 16
+
+# 长轮询超时（秒）：getUpdates 在服务端挂起等待，有新更新时立即返回
+POLL_TIMEOUT = 30
+
+# 订阅的更新类型：仅处理新消息与内联按钮回调（私聊/群组模式相同）
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+# 发送限速（参考 Telegram 官方建议）：(每秒补充令牌数, 令牌桶容量)
+_RATE_GLOBAL = (30.0, 30)  # 全局每秒 30 条
+_RATE_PRIVATE = (1.0, 3)  # 单个私聊每秒 1 条，允许少量突发
+_RATE_GROUP = (20 / 60, 20)  # 单个群组每分钟 20 条
+_RATE_MANAGER = (10.0, 30)  # 管理员会话汇集所有用户的转发，使用更高的限额（超出时依赖 429 重试）
+_RATE_BUCKETS_MAX = 1024  # 会话令牌桶数量超过该值时清理已回满的桶
+
+# 管理员帮助信息
+HELP_MSG = (
+    "可用命令：\n"
+    "/start - 启动机器人\n"
+    "/help - 显示帮助信息\n"
+    "/status - 查看机器人状态\n"
+    "/block_list - 查看封禁用户列表\n\n"
+    "直接发送消息即可与管理员通信"
+)
+
+# /start 欢迎信息模板
+WELCOME_TPL = (
+    "欢迎使用 Telegram 双向私聊机器人！\n\n"
+    "你的用户ID: {chat_id}\n"
+    "用户名: @{username}\n\n"
+    "直接发送消息即可与管理员通信"
+)
+
+# 静态内联按钮（PTB 对象创建后不可变，可安全复用）
+CLOSE_BUTTON = InlineKeyboardButton(text="❌ 关闭", callback_data="close_block_list")
+CLOSE_ROW = [CLOSE_BUTTON]
+HELP_REPLY_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton(text="📖 查看帮助", callback_data="show_help")]
+])
+
+# 转发消息中用户信息段落的分隔线
+USER_INFO_SEP = "\n\n" + "=" * 25
+
+BLOCK_BTN_TEXT = "🚫 封禁用户"
+
+# 转发给管理员的消息ID -> (用户ID, 用户名)，用于回复/封禁时免去正则解析
+_FORWARD_MAP_MAX = 2000
+_forward_map: "OrderedDict[int, Tuple[int, str]]" = OrderedDict()
+
+# 延迟删除调度：(到期时间, 序号, 消息) 小顶堆
+_delete_heap: List[Tuple[float, int, Message]] = []
+_delete_seq = itertools.count()
+_delete_event: Optional[asyncio.Event] = None
+_delete_task: Optional[asyncio.Task] = None
+
+# 封禁关键词匹配器缓存（配置版本变化时重建）
+_kw_version: Optional[int] = None
+_kw_automaton = None
+
+
+def log_error(log: logging.Logger, what: str, e: BaseException):
+    """
+    记录处理更新时的错误，同类错误每分钟最多输出一次完整堆栈，其余只记录单行信息
+    
+    Args:
+        log: 所在模块的 logger
+        what: 错误描述（同时作为限频的分类键）
+        e: 异常对象
+    """
+    now = time.monotonic()
+    last = _error_logged.get(what)
+    with_traceback = last is None or now - last >= _ERROR_TRACEBACK_INTERVAL
+    if with_traceback:
+        _error_logged[what] = now
+    log.error("[%s] %s: %s", PLUGIN_ID, what, e, exc_info=with_traceback)
+
+
+class _TokenBucket:
+    """令牌桶（预约式：令牌可透支，返回需等待的时间）"""
+    
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+    
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+    
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def reserve(self, now: float) -> float:
+        """取出一个令牌，返回需要等待的秒数"""
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+    
+    def is_full(self, now: float) -> bool:
+        """令牌是否已回满（空闲的桶可以丢弃）"""
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class TokenBucketRateLimiter(BaseRateLimiter):
+    """
+    本地令牌桶限速器：发送前在本地等待，避免触发 Telegram 429 后被长时间限流
+    
+    全局与单会话两级限速，群组会话（负数ID）使用更严格的每分钟限额，
+    管理员会话使用更宽松的限额，避免大量用户同时来信时转发排队
+    """
+    
+    def __init__(self, max_retries: int = 1):
+        self._max_retries = max_retries
+        self._global = _TokenBucket(*_RATE_GLOBAL)
+        self._chats: Dict[Union[int, str], _TokenBucket] = {}
+    
+    async def initialize(self) -> None:
+        pass
+    
+    async def shutdown(self) -> None:
+        self._chats.clear()
+    
+    def _chat_bucket(self, chat_id: Union[int, str], now: float) -> _TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= _RATE_BUCKETS_MAX:
+                self._chats = {k: b for k, b in self._chats.items() if not b.is_full(now)}
+            try:
+                chat_id_int = int(chat_id)
+            except (TypeError, ValueError):
+                chat_id_int = None  # @频道用户名按群组限额处理
+            if chat_id_int is None or chat_id_int < 0:
+                rate = _RATE_GROUP
+            elif chat_id_int == config.manager_chatid_int:
+                rate = _RATE_MANAGER
+            else:
+                rate = _RATE_PRIVATE
+            bucket = _TokenBucket(*rate)
+            self._chats[chat_id] = bucket
+        return bucket
+    
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ):
+        # 拉取更新不计入发送限额
+        if endpoint != "getUpdates":
+            now = time.monotonic()
+            delay = self._global.reserve(now)
+            chat_id = data.get("chat_id")
+            if chat_id is not None:
+                delay = max(delay, self._chat_bucket(chat_id, now).reserve(now))
+            if delay > 0:
+                await asyncio.sleep(delay)
+        
+        for attempt in range(self._max_retries + 1):
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self._max_retries:
+                    raise
+                retry_after = e.retry_after
+                if hasattr(retry_after, "total_seconds"):
+                    retry_after = retry_after.total_seconds()
+                logger.warning("触发 Telegram 限流，%s 秒后重试: %s", retry_after, endpoint)
+                await asyncio.sleep(retry_after)
+
+
+def _build_rate_limiter() -> BaseRateLimiter:
+    """优先使用 PTB 自带的 AIORateLimiter（需安装 python-telegram-bot[rate-limiter]），否则使用本地令牌桶"""
     try:
-        manager_chatid = config.manager_chatid
-        if not manager_chatid:
-            return False
-        return str(chat_id) == str(manager_chatid)
-    except Exception as e:
-        logger.error("检查管理员身份失败: %s", e, exc_info=True)
-        return False
+        return AIORateLimiter(
+            overall_max_rate=28,
+            overall_time_period=1,
+            group_max_rate=18,
+            group_time_period=60,
+            max_retries=3,
+        )
+    except RuntimeError:
+        return TokenBucketRateLimiter()
+
+
+def build_application(concurrent: bool = False) -> Application:
+    """
+    根据配置构建 Application（私聊/群组模式共用）
+    
+    Args:
+        concurrent: 是否并发处理更新（仅适用于按会话队列保证转发顺序的私聊模式）
+    
+    Raises:
+        RuntimeError: 配置了 Webhook 但未安装 Webhook 依赖
+    """
+    if config.webhook_url and tornado is None:
+        raise RuntimeError(
+            "Webhook 模式需要安装 python-telegram-bot[webhooks]，"
+            "请执行 pip install \"python-telegram-bot[webhooks]\" 或清空 Webhook 地址改用轮询模式"
+        )
+    proxy_url = config.proxy
+    # 发送请求与拉取更新使用独立连接池，避免长轮询占用发送连接
+    # HTTP/2 下并发发送复用同一连接，不再受连接池大小限制
+    request = HTTPXRequest(
+        connection_pool_size=_SEND_POOL_SIZE,
+        pool_timeout=20.0,
+        read_timeout=20.0,
+        write_timeout=30.0,
+        proxy=proxy_url,
+        http_version=_HTTP_VERSION,
+    )
+    get_updates_request = HTTPXRequest(
+        connection_pool_size=_UPDATES_POOL_SIZE,
+        pool_timeout=20.0,
+        read_timeout=20.0,
+        write_timeout=30.0,
+        proxy=proxy_url,
+    )
+    builder = (
+        Application.builder()
+        .token(config.bot_token)
+        .request(request)
+        .get_updates_request(get_updates_request)
+        .rate_limiter(_build_rate_limiter())
+    )
+    if concurrent:
+        # 更新处理以 IO 为主，并发处理不同更新；调用方需将用户消息与管理员回复都放入会话队列以保证顺序
+        builder = builder.concurrent_updates(min(config.concurrent_updates, _SEND_POOL_SIZE))
+    api_server = config.bot_api_server
+    if api_server:
+        # 使用自建 Bot API 服务器，降低请求往返延迟
+        builder = builder.base_url(f"{api_server}/bot").base_file_url(f"{api_server}/file/bot")
+    return builder.build()
+
+
+async def start_updater(application: Application):
+    """
+    启动更新接收（私聊/群组模式共用）
+    
+    配置了 webhook_url 时由 Telegram 推送更新，否则使用长轮询
+    """
+    webhook_url = config.webhook_url
+    if webhook_url:
+        await application.updater.start_webhook(
+            listen="0.0.0.0",
+            port=config.webhook_port,
+            url_path=urlparse(webhook_url).path.lstrip("/"),
+            webhook_url=webhook_url,
+            secret_token=config.webhook_secret,
+            allowed_updates=ALLOWED_UPDATES,
+            drop_pending_updates=True
+        )
+        return
+    await application.updater.start_polling(
+        allowed_updates=ALLOWED_UPDATES,
+        drop_pending_updates=True,
+        timeout=POLL_TIMEOUT,
+        poll_interval=0,
+        bootstrap_retries=-1
+    )
+
+
+def _photo_file_id(message: Message) -> Optional[str]:
+    """取最大尺寸图片的 file_id（只读取一次 photo 属性）"""
+    photo = message.photo
+    return photo[-1].file_id if photo else None
+
+
+# 支持转发的媒体类型：(消息属性/发送类型, 中文名称, file_id 提取函数)
+MEDIA_SPECS = (
+    ("photo", "图片", _photo_file_id),
+    ("document", "文档", lambda m: m.document.file_id if m.document else None),
+    ("video", "视频", lambda m: m.video.file_id if m.video else None),
+    ("audio", "音频", lambda m: m.audio.file_id if m.audio else None),
+    ("voice", "语音", lambda m: m.voice.file_id if m.voice else None),
+)
+
+# 媒体类型键 -> Bot 发送方法名（参数名与类型键相同）
+MEDIA_SEND_METHODS = {
+    "photo": "send_photo",
+    "document": "send_document",
+    "video": "send_video",
+    "audio": "send_audio",
+    "voice": "send_voice",
+}
+
+
+def detect_media(message: Message) -> Tuple[Optional[str], str, Optional[str]]:
+    """
+    识别消息中的媒体
+    
+    Returns:
+        Tuple: (媒体类型键, 中文名称, file_id)，无媒体时返回 (None, "未知类型", None)
+    """
+    for key, label, get_file_id in MEDIA_SPECS:
+        file_id = get_file_id(message)
+        if file_id:
+            return key, label, file_id
+    return None, "未知类型", None
+
+
+def get_manager_id() -> Optional[int]:
+    """获取整数形式的管理员ChatID（加载配置时已解析）"""
+    return config.manager_chatid_int
+
+
+def is_manager(chat_id: int) -> bool:
+    """判断是否管理员（与加载配置时解析好的整数ID比较）"""
+    manager_id = config.manager_chatid_int
+    return manager_id is not None and chat_id == manager_id
+
+
+def _ensure_keyword_matcher():
+    """配置版本变化时重建 Aho-Corasick 关键词自动机（未安装 pyahocorasick 时使用配置中的正则）"""
+    global _kw_version, _kw_automaton
+    version = config.version
+    if version == _kw_version:
+        return
+    keywords = sorted({k.lower() for k in config.block_keywords or ()})
+    _kw_automaton = None
+    if keywords and ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for k in keywords:
+            automaton.add_word(k, k)
+        automaton.make_automaton()
+        _kw_automaton = automaton
+    _kw_version = version
 
 
 def contains_block_keywords(text: str) -> bool:
@@ -30,59 +386,161 @@ def contains_block_keywords(text: str) -> bool:
     try:
         if not text:
             return False
-        block_keywords = config.block_keywords
-        if not block_keywords:
+        _ensure_keyword_matcher()
+        if _kw_automaton is not None:
+            for _ in _kw_automaton.iter(text.lower()):
+                return True
             return False
-        lower = text.lower()
-        return any(k.lower() in lower for k in block_keywords)
+        pattern = config.block_keywords_pattern
+        if pattern is not None:
+            return pattern.search(text) is not None
+        return False
     except Exception as e:
-        logger.error("检查关键词失败: %s", e, exc_info=True)
+        log_error(logger, "检查关键词失败", e)
         return False
 
 
+async def _delete_worker():
+    """按到期时间顺序删除消息的后台任务（所有延迟删除共用一个计时器）"""
+    while True:
+        if not _delete_heap:
+            _delete_event.clear()
+            await _delete_event.wait()
+            continue
+        timeout = _delete_heap[0][0] - time.monotonic()
+        if timeout > 0:
+            _delete_event.clear()
+            try:
+                await asyncio.wait_for(_delete_event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        # 取出所有已到期的消息并发删除
+        now = time.monotonic()
+        due = []
+        while _delete_heap and _delete_heap[0][0] <= now:
+            due.append(heapq.heappop(_delete_heap)[2])
+        await _delete_messages(due)
+
+
+async def _delete_messages(messages: List[Message]):
+    """并发删除消息，已被删除的消息不视为错误"""
+    results = await asyncio.gather(*(m.delete() for m in messages), return_exceptions=True)
+    for result in results:
+        if not isinstance(result, Exception):
+            continue
+        if isinstance(result, BadRequest) and "not found" in str(result).lower():
+            logger.debug("待删除的消息已不存在: %s", result)
+        else:
+            logger.error("自动删除消息失败: %s", result)
+
+
 def delete_message_after_delay(message: Message, delay: int = 10):
     """延迟删除消息"""
-    async def delete_after_delay():
-        try:
-            await asyncio.sleep(delay)
-            await message.delete()
-        except Exception as e:
-            logger.error("自动删除消息失败: %s", e, exc_info=True)
-    asyncio.create_task(delete_after_delay())
+    global _delete_event, _delete_task
+    heapq.heappush(_delete_heap, (time.monotonic() + delay, next(_delete_seq), message))
+    if _delete_task is None or _delete_task.done():
+        _delete_event = asyncio.Event()
+        _delete_task = asyncio.create_task(_delete_worker())
+    _delete_event.set()
+
+
+async def flush_pending_deletes():
+    """停止机器人前调用：取消延迟删除任务，并立即删除所有待删除的消息"""
+    global _delete_task
+    if _delete_task is not None:
+        _delete_task.cancel()
+        _delete_task = None
+    if _delete_heap:
+        messages = [item[2] for item in _delete_heap]
+        _delete_heap.clear()
+        await _delete_messages(messages)
+
+
+def format_user_info(user, chat_id: int) -> str:
+    """构造转发消息末尾的用户信息段落（私聊/群组模式共用）"""
+    parts = [USER_INFO_SEP, f"\n用户ID: {chat_id}"]
+    if user and (user.first_name or user.last_name):
+        full_name = f"{user.first_name or ''} {user.last_name or ''}".strip()
+        parts.append(f"\n姓名: {full_name}")
+    if user and user.username:
+        parts.append(f"\n用户名: @{user.username}")
+    return "".join(parts)
+
+
+@functools.lru_cache(maxsize=4096)
+def forward_markup(chat_id: int, user_name: Optional[str] = None) -> InlineKeyboardMarkup:
+    """
+    转发消息附带的内联键盘（按用户缓存，PTB 对象创建后不可变，可安全复用）
+    
+    Args:
+        chat_id: 用户聊天ID
+        user_name: 跳转按钮显示的用户名，为None时仅包含封禁按钮
+        
+    Returns:
+        InlineKeyboardMarkup: 内联键盘
+    """
+    block_row = [InlineKeyboardButton(text=BLOCK_BTN_TEXT, callback_data=f"block_user:{chat_id}")]
+    if user_name is None:
+        return InlineKeyboardMarkup([block_row])
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(text=user_name, url=f"tg://user?id={chat_id}")],
+        block_row,
+    ])
+
+
+def forward_user_name(user) -> str:
+    """转发消息中记录的用户名（与 extract_user_name_from_message 的解析结果一致）"""
+    if not user:
+        return ""
+    full_name = f"{user.first_name or ''} {user.last_name or ''}".strip()
+    if full_name:
+        return full_name
+    return f"@{user.username}" if user.username else ""
+
+
+def remember_forward(message_id: int, user_id: int, user_name: str = ""):
+    """记录转发给管理员的消息对应的用户（超出上限时淘汰最早的记录）"""
+    _forward_map[message_id] = (user_id, user_name)
+    _forward_map.move_to_end(message_id)
+    if len(_forward_map) > _FORWARD_MAP_MAX:
+        _forward_map.popitem(last=False)
+
+
+def lookup_forward(message_id: int) -> Optional[Tuple[int, str]]:
+    """查询转发消息对应的 (用户ID, 用户名)，未记录时返回 None"""
+    return _forward_map.get(message_id)
 
 
 def extract_user_id_from_message(message_text: str) -> Optional[int]:
     """从消息文本提取用户ID"""
     try:
-        pattern = r"用户ID:\s*(\d+)"
-        match = re.search(pattern, message_text)
+        match = _RE_USER_ID.search(message_text)
         if match:
             return int(match.group(1))
         return None
     except Exception as e:
-        logger.error("提取用户ID失败: %s", e, exc_info=True)
+        log_error(logger, "提取用户ID失败", e)
         return None
 
 
 def extract_user_name_from_message(message_text: str) -> Optional[str]:
     """从消息文本提取用户名/姓名"""
     try:
-        name_pattern = r"姓名:\s*([^\n]+)"
-        name_match = re.search(name_pattern, message_text)
+        name_match = _RE_NAME.search(message_text)
         if name_match:
             name = name_match.group(1).strip()
             if name:
                 return name
         
-        username_pattern = r"用户名:\s*@?([^\n]+)"
-        username_match = re.search(username_pattern, message_text)
+        username_match = _RE_USERNAME.search(message_text)
         if username_match:
             username = username_match.group(1).strip()
             if username:
                 return f"@{username}"
         return None
     except Exception as e:
-        logger.error("提取用户名失败: %s", e, exc_info=True)
+        log_error(logger, "提取用户名失败", e)
         return None
 
 
@@ -96,11 +554,7 @@ async def show_block_list(
         blocklist = config.get_blocklist()
         
         if user_id is not None:
-            user_info = None
-            for item in blocklist:
-                if item["user_id"] == user_id:
-                    user_info = item
-                    break
+            user_info = config.get_blocklist_index().get(user_id)
             if not user_info:
                 await message.reply_text("用户不存在于封禁列表中")
                 return
@@ -122,12 +576,7 @@ async def show_block_list(
                         callback_data=f"unblock_user:{user_id}:page:{page}"
                     )
                 ],
-                [
-                    InlineKeyboardButton(
-                        text="❌ 关闭",
-                        callback_data="close_block_list"
-                    )
-                ]
+                CLOSE_ROW,
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             try:
@@ -190,19 +639,14 @@ async def show_block_list(
                 )
             if nav_buttons:
                 keyboard.append(nav_buttons)
-        keyboard.append([
-            InlineKeyboardButton(
-                text="❌ 关闭",
-                callback_data="close_block_list"
-            )
-        ])
+        keyboard.append(CLOSE_ROW)
         reply_markup = InlineKeyboardMarkup(keyboard)
         try:
             await message.edit_text(help_msg, reply_markup=reply_markup)
         except Exception:
             await message.reply_text(help_msg, reply_markup=reply_markup)
     except Exception as e:
-        logger.error("显示封禁列表失败: %s", e, exc_info=True)
+        log_error(logger, "显示封禁列表失败", e)
 
 
 async def handle_help_command(update, context):
@@ -211,24 +655,16 @@ async def handle_help_command(update, context):
         chat_id = update.effective_chat.id
         if not is_manager(chat_id):
             return
-        help_msg = (
-            "可用命令：\n"
-            "/start - 启动机器人\n"
-            "/help - 显示帮助信息\n"
-            "/status - 查看机器人状态\n"
-            "/block_list - 查看封禁用户列表\n\n"
-            "直接发送消息即可与管理员通信"
-        )
         try:
-            await update.message.reply_text(help_msg)
+            await update.message.reply_text(HELP_MSG)
         except Exception as e:
             logger.warning("reply_text help 失败，改用 send_message: %s", e)
             await context.bot.send_message(
                 chat_id=chat_id,
-                text=help_msg,
+                text=HELP_MSG,
             )
     except Exception as e:
-        logger.error("处理 /help 命令失败: %s", e, exc_info=True)
+        log_error(logger, "处理 /help 命令失败", e)
 
 
 async def handle_status_command(
@@ -257,7 +693,7 @@ async def handle_status_command(
                 text=status_msg,
             )
     except Exception as e:
-        logger.error("处理 /status 命令失败: %s", e, exc_info=True)
+        log_error(logger, "处理 /status 命令失败", e)
 
 
 async def handle_block_list_command(update, context):
@@ -275,7 +711,112 @@ async def handle_block_list_command(update, context):
                 text="封禁列表加载失败，请稍后重试。",
             )
     except Exception as e:
-        logger.error("处理 /block_list 命令失败: %s", e, exc_info=True)
+        log_error(logger, "处理 /block_list 命令失败", e)
+
+
+async def _cb_block_user(query, parts):
+    """回调：封禁用户（block_user:<user_id>）"""
+    try:
+        user_id = int(parts[1])
+        if config.is_blocked(user_id):
+            await query.answer("该用户已被封禁", show_alert=True)
+            return
+        user_name = ""
+        original_message = query.message
+        if original_message:
+            forwarded = lookup_forward(original_message.message_id)
+            if forwarded:
+                user_name = forwarded[1]
+            else:
+                message_text = original_message.text or original_message.caption or ""
+                if message_text:
+                    user_name = extract_user_name_from_message(message_text) or ""
+        success = config.add_to_blocklist(user_id, user_name)
+        if success:
+            await query.answer("✓ 用户已封禁", show_alert=True)
+            
+            # 更新按钮状态
+            try:
+                if original_message and original_message.reply_markup:
+                    keyboard = original_message.reply_markup.inline_keyboard
+                    new_keyboard = []
+                    for row in keyboard:
+                        new_row = []
+                        for button in row:
+                            if button.callback_data == query.data:
+                                new_row.append(
+                                    InlineKeyboardButton(
+                                        text="✅ 已封禁",
+                                        callback_data="already_blocked"
+                                    )
+                                )
+                            else:
+                                new_row.append(button)
+                        new_keyboard.append(new_row)
+                    
+                    new_reply_markup = InlineKeyboardMarkup(new_keyboard)
+                    await original_message.edit_reply_markup(reply_markup=new_reply_markup)
+            except Exception as e:
+                logger.error("更新按钮状态失败: %s", e)
+        else:
+            await query.answer("✗ 封禁失败，请稍后重试", show_alert=True)
+    except (ValueError, IndexError):
+        await query.answer("无效的用户ID", show_alert=True)
+    except Exception as e:
+        log_error(logger, "处理封禁回调失败", e)
+        await query.answer("处理失败，请稍后重试", show_alert=True)
+
+
+async def _cb_show_help(query, parts):
+    """回调：显示帮助"""
+    await query.message.reply_text(HELP_MSG)
+
+
+async def _cb_block_list(query, parts):
+    """回调：封禁列表翻页（block_list:page:<page>）或用户详情（block_list:user:<user_id>:page:<page>）"""
+    if len(parts) >= 3 and parts[1] == "page":
+        page = int(parts[2])
+        await show_block_list(query.message, page=page)
+    elif len(parts) >= 5 and parts[1] == "user":
+        user_id = int(parts[2])
+        page = int(parts[4])
+        await show_block_list(
+            query.message,
+            page=page,
+            user_id=user_id,
+        )
+
+
+async def _cb_unblock_user(query, parts):
+    """回调：解除封禁（unblock_user:<user_id>:page:<page>）"""
+    if len(parts) >= 4:
+        user_id = int(parts[1])
+        page = int(parts[3])
+        success = config.remove_from_blocklist(user_id)
+        if success:
+            await query.answer("✓ 用户已解除封禁", show_alert=True)
+            await show_block_list(query.message, page=page)
+        else:
+            await query.answer("✗ 解除封禁失败", show_alert=True)
+
+
+async def _cb_close_block_list(query, parts):
+    """回调：关闭封禁列表"""
+    try:
+        await query.message.delete()
+    except Exception as e:
+        logger.error("删除消息失败: %s", e)
+        await query.answer("删除消息失败", show_alert=True)
+
+
+# 回调前缀 -> 处理函数
+_CALLBACK_HANDLERS = {
+    "block_user": _cb_block_user,
+    "show_help": _cb_show_help,
+    "block_list": _cb_block_list,
+    "unblock_user": _cb_unblock_user,
+    "close_block_list": _cb_close_block_list,
+}
 
 
 async def handle_callback_query_common(update, context):
@@ -298,103 +839,9 @@ async def handle_callback_query_common(update, context):
         
         await query.answer()
         
-        if callback_data.startswith("block_user:"):
-            user_id_str = callback_data.split(":", 1)[1]
-            try:
-                user_id = int(user_id_str)
-                if config.is_blocked(user_id):
-                    await query.answer("该用户已被封禁", show_alert=True)
-                    return
-                user_name = ""
-                original_message = query.message
-                if original_message:
-                    message_text = original_message.text or original_message.caption or ""
-                    if message_text:
-                        name_match = re.search(r'姓名:\s*([^\n]+)', message_text)
-                        if name_match:
-                            user_name = name_match.group(1).strip()
-                        else:
-                            username_match = re.search(r'用户名:\s*@?([^\n]+)', message_text)
-                            if username_match:
-                                user_name = f"@{username_match.group(1).strip()}"
-                success = config.add_to_blocklist(user_id, user_name)
-                if success:
-                    await query.answer("✓ 用户已封禁", show_alert=True)
-                    
-                    # 更新按钮状态
-                    try:
-                        original_message = query.message
-                        if original_message and original_message.reply_markup:
-                            keyboard = original_message.reply_markup.inline_keyboard
-                            new_keyboard = []
-                            for row in keyboard:
-                                new_row = []
-                                for button in row:
-                                    if button.callback_data == callback_data:
-                                        new_row.append(
-                                            InlineKeyboardButton(
-                                                text="✅ 已封禁",
-                                                callback_data="already_blocked"
-                                            )
-                                        )
-                                    else:
-                                        new_row.append(button)
-                                new_keyboard.append(new_row)
-                            
-                            new_reply_markup = InlineKeyboardMarkup(new_keyboard)
-                            await original_message.edit_reply_markup(reply_markup=new_reply_markup)
-                    except Exception as e:
-                        logger.error("更新按钮状态失败: %s", e, exc_info=True)
-                else:
-                    await query.answer("✗ 封禁失败，请稍后重试", show_alert=True)
-            except ValueError:
-                await query.answer("无效的用户ID", show_alert=True)
-            except Exception as e:
-                logger.error("处理封禁回调失败: %s", e, exc_info=True)
-                await query.answer("处理失败，请稍后重试", show_alert=True)
-        
-        elif callback_data == "show_help":
-            help_msg = (
-                "可用命令：\n"
-                "/start - 启动机器人\n"
-                "/help - 显示帮助信息\n"
-                "/status - 查看机器人状态\n"
-                "/block_list - 查看封禁用户列表\n\n"
-                "直接发送消息即可与管理员通信"
-            )
-            await query.message.reply_text(help_msg)
-        
-        elif callback_data.startswith("block_list:"):
-            parts = callback_data.split(":")
-            if len(parts) >= 3 and parts[1] == "page":
-                page = int(parts[2])
-                await show_block_list(query.message, page=page)
-            elif len(parts) >= 5 and parts[1] == "user":
-                user_id = int(parts[2])
-                page = int(parts[4]) if len(parts) > 4 else 0
-                await show_block_list(
-                    query.message,
-                    page=page,
-                    user_id=user_id,
-                )
-        
-        elif callback_data.startswith("unblock_user:"):
-            parts = callback_data.split(":")
-            if len(parts) >= 4:
-                user_id = int(parts[1])
-                page = int(parts[3])
-                success = config.remove_from_blocklist(user_id)
-                if success:
-                    await query.answer("✓ 用户已解除封禁", show_alert=True)
-                    await show_block_list(query.message, page=page)
-                else:
-                    await query.answer("✗ 解除封禁失败", show_alert=True)
-        
-        elif callback_data == "close_block_list":
-            try:
-                await query.message.delete()
-            except Exception as e:
-                logger.error("删除消息失败: %s", e, exc_info=True)
-                await query.answer("删除消息失败", show_alert=True)
+        parts = callback_data.split(":")
+        handler = _CALLBACK_HANDLERS.get(parts[0])
+        if handler:
+            await handler(query, parts)
     except Exception as e:
-        logger.error("处理回调查询失败: %s", e, exc_info=True)
+        log_error(logger, "处理回调查询失败", e)